@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Per-tenant admission control for the chatbot's /chat endpoint.
+
+Requests are admitted into a fixed number of slots shared by all companies:
+    - each company may hold at most `tenant_limit` slots at once
+    - waiting requests are served by start-time fair queuing across
+      company_ids, weighted per company, so one busy tenant cannot starve
+      the others (FIFO within a company)
+    - a request that waits longer than `max_wait` seconds, or arrives when
+      its company already has `max_queue` waiters, is rejected with
+      AdmissionRejected carrying a Retry-After estimate
+
+Runs on the event loop (asyncio only, no threads), so waiting requests do
+not hold threadpool workers.
+
+    async with admission.slot(company_id):
+        ...
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from metrics import counter, gauge, histogram
+
+ADMISSION_QUEUE_TIME = histogram(
+    "admission_queue_seconds", "Time chat requests waited for an admission slot", ("company_id",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+ADMISSION_REJECTIONS = counter(
+    "admission_rejections_total", "Chat requests shed by the admission controller", ("company_id", "reason")
+)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retry_after: int, reason: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("future", "tag", "enqueued")
+
+    def __init__(self, future: asyncio.Future, tag: float):
+        self.future = future
+        self.tag = tag
+        self.enqueued = time.monotonic()
+
+
+class _Tenant:
+    __slots__ = ("weight", "active", "waiters", "last_finish")
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.active = 0
+        self.waiters: Deque[_Waiter] = deque()
+        self.last_finish = 0.0
+
+
+class AdmissionController:
+    def __init__(self, total_limit: int, tenant_limit: int, max_wait: float, max_queue: int,
+                 weights: Optional[Dict[str, float]] = None):
+        self.total_limit = max(1, total_limit)
+        self.tenant_limit = max(1, tenant_limit)
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.weights = weights or {}
+        self._tenants: Dict[str, _Tenant] = {}
+        self._active = 0
+        self._virtual_time = 0.0
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._avg_hold = 1.0
+
+        gauge("admission_in_flight", "Chat requests holding an admission slot", ("company_id",)).set_function(
+            lambda: {(cid,): t.active for cid, t in self._tenants.items()})
+        gauge("admission_queue_depth", "Chat requests waiting for an admission slot", ("company_id",)).set_function(
+            lambda: {(cid,): len(t.waiters) for cid, t in self._tenants.items()})
+
+    def _tenant(self, company_id: str) -> _Tenant:
+        tenant = self._tenants.get(company_id)
+        if tenant is None:
+            tenant = self._tenants[company_id] = _Tenant(self.weights.get(company_id, 1.0))
+        return tenant
+
+    def _retry_after(self, company_id: str) -> int:
+        queued = len(self._tenant(company_id).waiters) + 1
+        return max(1, math.ceil(self._avg_hold * queued / self.tenant_limit))
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the eligible waiter with the smallest start tag."""
+        while self._active < self.total_limit:
+            best: Optional[_Tenant] = None
+            for tenant in self._tenants.values():
+                if tenant.waiters and tenant.active < self.tenant_limit:
+                    if best is None or tenant.waiters[0].tag < best.waiters[0].tag:
+                        best = tenant
+            if best is None:
+                return
+            waiter = best.waiters.popleft()
+            if waiter.future.done():  # cancelled while queued
+                continue
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            best.active += 1
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def _release(self, tenant: _Tenant, held: float) -> None:
+        tenant.active -= 1
+        self._active -= 1
+        self._avg_hold = 0.9 * self._avg_hold + 0.1 * held
+        self._dispatch()
+
+    async def acquire(self, company_id: str, max_wait: Optional[float] = None) -> None:
+        """Wait for a slot; max_wait can only shorten the controller's own limit."""
+        tenant = self._tenant(company_id)
+        # Start-time fair queuing: a tenant's next tag advances by 1/weight per request
+        start = max(self._virtual_time, tenant.last_finish)
+        if not tenant.waiters and tenant.active < self.tenant_limit and self._active < self.total_limit:
+            tenant.last_finish = start + 1.0 / max(tenant.weight, 1e-6)
+            tenant.active += 1
+            self._active += 1
+            ADMISSION_QUEUE_TIME.observe(0.0, company_id=company_id)
+            return
+
+        if len(tenant.waiters) >= self.max_queue:
+            ADMISSION_REJECTIONS.inc(company_id=company_id, reason="queue_full")
+            raise AdmissionRejected("Too many requests queued for this company", self._retry_after(company_id),
+                                    "queue_full")
+
+        tenant.last_finish = start + 1.0 / max(tenant.weight, 1e-6)
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), start)
+        tenant.waiters.append(waiter)
+        self._dispatch()
+
+        try:
+            timeout = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                # Granted at the deadline; hand the slot back
+                self._release(tenant, 0.0)
+            else:
+                waiter.future.cancel()
+                tenant.waiters.remove(waiter)
+            ADMISSION_QUEUE_TIME.observe(time.monotonic() - waiter.enqueued, company_id=company_id)
+            ADMISSION_REJECTIONS.inc(company_id=company_id, reason="timeout")
+            raise AdmissionRejected("Timed out waiting for capacity", self._retry_after(company_id), "timeout")
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(tenant, 0.0)
+            else:
+                waiter.future.cancel()
+                if waiter in tenant.waiters:
+                    tenant.waiters.remove(waiter)
+            raise
+        ADMISSION_QUEUE_TIME.observe(time.monotonic() - waiter.enqueued, company_id=company_id)
+
+    @asynccontextmanager
+    async def slot(self, company_id: str, max_wait: Optional[float] = None):
+        await self.acquire(company_id, max_wait)
+        tenant = self._tenants[company_id]
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(tenant, time.monotonic() - start)
+
+    def stats(self) -> dict:
+        return {
+            "total_limit": self.total_limit,
+            "tenant_limit": self.tenant_limit,
+            "in_flight": self._active,
+            "queued": sum(len(t.waiters) for t in self._tenants.values()),
+            "tenants": {
+                cid: {"in_flight": t.active, "queued": len(t.waiters), "weight": t.weight}
+                for cid, t in self._tenants.items() if t.active or t.waiters
+            },
+        }
+
+
+def parse_weights(setting: str) -> Dict[str, float]:
+    """Parse "company_a:2,company_b:0.5" into {company_id: weight}."""
+    weights = {}
+    for item in (setting or "").split(","):
+        if ":" in item:
+            company_id, weight = item.rsplit(":", 1)
+            weights[company_id.strip()] = float(weight)
+    return weights
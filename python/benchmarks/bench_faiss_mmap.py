@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""Memory and latency of memory-mapped vs. per-process FAISS indexes.
+
+Writes a synthetic tenant index with faiss_store.save(), then starts
+--workers processes per mode, as uvicorn would. Each one opens the index via
+faiss_store.load() with FAISS_INDEX_STORE=memory (private copy) or mmap
+(shared page cache) and runs --queries searches. Once all workers are loaded
+it records their RSS and PSS; PSS splits shared pages between the processes
+mapping them, so the sum of PSS is what the host actually pays.
+
+Usage (from the python/ directory):
+    python benchmarks/bench_faiss_mmap.py --vectors 100000 --workers 4
+    python benchmarks/bench_faiss_mmap.py --compare benchmarks/results/old_faiss.json
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+from common import PYTHON_DIR, RESULTS_DIR, Timer, compare_results, rss_bytes, summarize, write_results
+
+MODES = ["memory", "mmap"]
+INDEX_KEY = "bench"
+
+
+def pss_bytes() -> int:
+    """Proportional set size (Linux only); 0 where /proc/self/smaps_rollup is missing."""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def build_store(directory: str, vectors: int, dim: int) -> None:
+    import faiss
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((vectors, dim), dtype=np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    index = faiss.IndexFlatL2(dim)
+    index.add(data)
+
+    class Store:  # faiss_store.save() only needs .index
+        pass
+
+    store = Store()
+    store.index = index
+    texts = [f"Question {i}? Answer {i}: onboarding policy text for benchmark purposes." for i in range(vectors)]
+    metadatas = [{"id": str(i), "question": f"Question {i}?", "answer": f"Answer {i}", "category": "bench"}
+                 for i in range(vectors)]
+    os.environ["FAISS_INDEX_DIR"] = directory
+    import faiss_store
+    faiss_store.save(INDEX_KEY, store, texts, metadatas)
+
+
+def worker(mode: str, dim: int, queries: int, k: int, loaded, done, results) -> None:
+    os.environ["FAISS_INDEX_STORE"] = mode
+    sys.path.insert(0, str(PYTHON_DIR))
+    import numpy as np
+    import faiss  # noqa: F401  (import cost is not part of the load time)
+    import faiss_store
+    from langchain_core.embeddings import FakeEmbeddings
+
+    before = rss_bytes()
+    with Timer() as load_timer:
+        db = faiss_store.load(INDEX_KEY, FakeEmbeddings(size=dim), record=False)
+    rng = np.random.default_rng(os.getpid())
+    latencies = []
+    for _ in range(queries):
+        query = rng.standard_normal((1, dim), dtype=np.float32)
+        start = time.perf_counter()
+        db.index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+
+    loaded.wait()  # every worker holds its index before memory is measured
+    results.put({
+        "load_ms": load_timer.elapsed * 1000,
+        "rss_bytes": rss_bytes(),
+        "rss_growth_bytes": rss_bytes() - before,
+        "pss_bytes": pss_bytes(),
+        "latencies": latencies,
+    })
+    done.wait()
+
+
+def bench_mode(mode: str, args):
+    ctx = mp.get_context("spawn")
+    loaded, done = ctx.Barrier(args.workers), ctx.Barrier(args.workers + 1)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(mode, args.dim, args.queries, args.k, loaded, done, results))
+             for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    reports = [results.get() for _ in procs]
+    done.wait()
+    for p in procs:
+        p.join()
+
+    latencies = [s for r in reports for s in r["latencies"]]
+    summary = summarize(latencies)
+    return {
+        "workers": args.workers,
+        "index_load_ms": round(max(r["load_ms"] for r in reports), 1),
+        "rss_per_worker_bytes": round(sum(r["rss_bytes"] for r in reports) / len(reports)),
+        "rss_growth_per_worker_bytes": round(sum(r["rss_growth_bytes"] for r in reports) / len(reports)),
+        "rss_total_bytes": sum(r["rss_bytes"] for r in reports),
+        "pss_total_bytes": sum(r["pss_bytes"] for r in reports),
+        "search_p50_ms": summary["p50_ms"],
+        "search_p95_ms": summary["p95_ms"],
+        "search_p99_ms": summary["p99_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", type=lambda s: s.split(","), default=MODES)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768, help="text-embedding-004 returns 768 dimensions")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200, help="searches per worker")
+    parser.add_argument("--k", type=int, default=12)
+    parser.add_argument("--output", default=str(RESULTS_DIR / "faiss_mmap_results.json"))
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(PYTHON_DIR))
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="faiss-bench-") as directory:
+        with Timer() as build:
+            build_store(directory, args.vectors, args.dim)
+        index_bytes = os.path.getsize(os.path.join(directory, f"{INDEX_KEY}.faiss"))
+        print(f"[INFO] Wrote {args.vectors} x {args.dim} index ({index_bytes / 2**20:.0f} MiB) "
+              f"in {build.elapsed:.1f}s")
+        for mode in args.modes:
+            results[mode] = bench_mode(mode, args)
+            r = results[mode]
+            print(f"[OK] {mode:6s}: PSS total {r['pss_total_bytes'] / 2**20:7.0f} MiB, "
+                  f"RSS/worker {r['rss_per_worker_bytes'] / 2**20:6.0f} MiB, "
+                  f"load {r['index_load_ms']:7.1f} ms, search p50 {r['search_p50_ms']} ms "
+                  f"p95 {r['search_p95_ms']} ms")
+    results["index_bytes"] = index_bytes
+
+    write_results(args.output, "faiss_mmap", results, {
+        "vectors": args.vectors, "dim": args.dim, "workers": args.workers, "queries": args.queries, "k": args.k,
+    })
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        for line in regressions:
+            print(f"[WARN] regression: {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
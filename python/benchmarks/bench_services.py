@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark harness for quiz_service and chatbot_service.
+
+Drives both FastAPI apps in-process through httpx's ASGI transport with the
+local stub LLM/embedding provider, so no network or Gemini quota is used.
+
+Measures:
+    - /chat and /ai (text, PDF, image) latency percentiles and throughput
+    - chatbot index build time vs. knowledge base size
+    - extract_text_from_pdf throughput vs. page count
+    - memory growth over many chat sessions
+
+Usage (from the python/ directory):
+    python benchmarks/bench_services.py --output benchmarks/results/baseline.json
+    python benchmarks/bench_services.py --compare benchmarks/results/baseline.json --threshold 0.2
+    python benchmarks/bench_services.py --only chat,index_build
+"""
+
+import argparse
+import asyncio
+import csv
+import gc
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from common import (
+    PYTHON_DIR,
+    RESULTS_DIR,
+    Timer,
+    compare_results,
+    make_pdf,
+    make_png,
+    rss_bytes,
+    summarize,
+    use_stub_backends,
+    write_results,
+)
+
+SCENARIOS = ["chat", "ai_text", "ai_pdf", "ai_image", "index_build", "pdf_extract", "memory"]
+
+CHAT_QUERIES = [
+    "How can I reset my password?",
+    "Where can I find the content assigned to me?",
+    "How do I contact my supervisor?",
+    "What happens when I complete a quiz?",
+    "How do I update my profile information?",
+]
+
+SAMPLE_TEXT = (
+    "Employee onboarding introduces new hires to company policies, tools and culture. "
+    "Trainees complete assigned content, acknowledge policies and take quizzes to confirm understanding. "
+) * 20
+
+
+async def run_load(client, send, total: int, concurrency: int):
+    """Issue `total` requests via `send(client, i)` with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await send(client, i)
+            elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def company_ids():
+    with open(PYTHON_DIR / "majestic_realistic_knowledge_base.csv", newline="", encoding="utf-8") as f:
+        return sorted({row["company_id"] for row in csv.DictReader(f)})
+
+
+def write_synthetic_kb(path: Path, company_id: str, entries: int) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["_id", "company_id", "category", "question", "answer", "keywords"])
+        for i in range(entries):
+            writer.writerow([
+                f"kb{i}", company_id, f"Category {i % 7}",
+                f"How does process {i} work for new employees?",
+                f"Process {i} is handled by department {i % 11}; see the onboarding guide section {i}.",
+                f"process, {i}",
+            ])
+
+
+async def bench_chat(args, httpx):
+    import chatbot_service
+
+    cid = company_ids()[0]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=chatbot_service.app), base_url="http://bench") as client:
+        # Warm the tenant index so the steady-state path is measured
+        await client.post("/chat", json={"query": "warm up", "company_id": cid, "user_id": "warmup"})
+
+        async def send(c, i):
+            return await c.post("/chat", json={
+                "query": CHAT_QUERIES[i % len(CHAT_QUERIES)], "company_id": cid, "user_id": f"bench-{i % 50}",
+            })
+
+        return await run_load(client, send, args.requests, args.concurrency)
+
+
+async def bench_ai(args, httpx, kind: str):
+    import quiz_service
+
+    pdf_bytes = make_pdf(args.pdf_pages)
+    png_bytes = make_png()
+
+    async def send(c, i):
+        if kind == "text":
+            return await c.post("/ai", json={"text": f"{SAMPLE_TEXT} Variant {i}.", "numQuestions": 5})
+        if kind == "pdf":
+            return await c.post("/ai", data={"numQuestions": "5"},
+                                files={"file": ("lesson.pdf", pdf_bytes, "application/pdf")})
+        return await c.post("/ai", data={"numQuestions": "5"},
+                            files={"file": ("slide.png", png_bytes, "image/png")})
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=quiz_service.app), base_url="http://bench") as client:
+        return await run_load(client, send, args.requests, args.concurrency)
+
+
+def bench_index_build(args):
+    import chatbot_service
+
+    results = {}
+    original_path = chatbot_service.CSV_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.corpus_sizes:
+            kb_path = Path(tmp) / f"kb_{size}.csv"
+            write_synthetic_kb(kb_path, "bench-company", size)
+            chatbot_service.CSV_PATH = kb_path
+            samples = []
+            for _ in range(args.repeat):
+                chatbot_service.chatbot_instances.pop("bench-company", None)
+                chatbot_service.vector_stores.pop("bench-company", None)
+                with Timer() as t:
+                    chatbot_service.initialize_chatbot("bench-company")
+                samples.append(t.elapsed)
+            results[str(size)] = summarize(samples)
+    chatbot_service.CSV_PATH = original_path
+    chatbot_service.chatbot_instances.pop("bench-company", None)
+    chatbot_service.vector_stores.pop("bench-company", None)
+    return results
+
+
+def bench_pdf_extract(args):
+    import quiz_service
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.page_counts:
+            pdf_path = Path(tmp) / f"doc_{pages}.pdf"
+            pdf_path.write_bytes(make_pdf(pages))
+            samples, chars = [], 0
+            for _ in range(args.repeat):
+                quiz_service._source_cache.clear()  # measure extraction, not the cache
+                with Timer() as t:
+                    chars = len(quiz_service.extract_text_from_pdf(str(pdf_path)))
+                samples.append(t.elapsed)
+            summary = summarize(samples)
+            mean_s = summary["mean_ms"] / 1000 or 1e-9
+            summary["pages_per_s"] = round(pages / mean_s, 2)
+            summary["chars_per_s"] = round(chars / mean_s, 2)
+            results[str(pages)] = summary
+    return results
+
+
+async def bench_memory(args, httpx):
+    import chatbot_service
+
+    cid = company_ids()[0]
+    checkpoints = []
+    gc.collect()
+    tracemalloc.start()
+    rss_start = rss_bytes()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=chatbot_service.app), base_url="http://bench") as client:
+        step = max(1, args.sessions // 10)
+        for i in range(args.sessions):
+            await client.post("/chat", json={
+                "query": CHAT_QUERIES[i % len(CHAT_QUERIES)], "company_id": cid, "user_id": f"session-{i}",
+            })
+            if (i + 1) % step == 0 or i + 1 == args.sessions:
+                traced, _ = tracemalloc.get_traced_memory()
+                checkpoints.append({
+                    "sessions": i + 1,
+                    "rss_bytes": rss_bytes(),
+                    "traced_bytes": traced,
+                    "history_keys": len(chatbot_service.chat_histories),
+                })
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    growth = checkpoints[-1]["rss_bytes"] - rss_start
+    return {
+        "sessions": args.sessions,
+        "rss_growth_bytes": growth,
+        "rss_growth_per_session_bytes": growth // max(1, args.sessions),
+        "traced_peak_bytes": traced_peak,
+        "checkpoints": checkpoints,
+    }
+
+
+async def main_async(args):
+    import httpx
+
+    results = {}
+    for name in args.only:
+        print(f"[INFO] Running {name} ...")
+        if name == "chat":
+            results[name] = await bench_chat(args, httpx)
+        elif name in ("ai_text", "ai_pdf", "ai_image"):
+            results[name] = await bench_ai(args, httpx, name.split("_", 1)[1])
+        elif name == "index_build":
+            results[name] = bench_index_build(args)
+        elif name == "pdf_extract":
+            results[name] = bench_pdf_extract(args)
+        elif name == "memory":
+            results[name] = await bench_memory(args, httpx)
+        print(f"[OK] {name}: {results[name]}")
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", type=lambda s: s.split(","), default=SCENARIOS,
+                        help=f"comma-separated scenarios ({','.join(SCENARIOS)})")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions for build/extract scenarios")
+    parser.add_argument("--corpus-sizes", type=lambda s: [int(x) for x in s.split(",")], default=[10, 100, 1000])
+    parser.add_argument("--page-counts", type=lambda s: [int(x) for x in s.split(",")], default=[1, 10, 50])
+    parser.add_argument("--pdf-pages", type=int, default=5, help="pages in the /ai PDF payload")
+    parser.add_argument("--sessions", type=int, default=1000, help="distinct chat sessions for the memory scenario")
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0)
+    parser.add_argument("--output", default=str(RESULTS_DIR / "bench_results.json"))
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+    unknown = set(args.only) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    use_stub_backends(args.llm_latency_ms, args.tokens_per_sec, args.embedding_latency_ms)
+    results = asyncio.run(main_async(args))
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    write_results(args.output, "services", results, config)
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        if regressions:
+            print(f"[WARN] {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("[OK] No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
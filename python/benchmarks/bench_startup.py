@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""Cold-start benchmark: import cost of each service, measured with `python -X importtime`.
+
+Each service module is imported in a fresh interpreter several times (stub
+provider, so no network). Reports the median total import time, the
+slowest direct imports, and fails when the median exceeds --max-ms.
+
+Usage (from the python/ directory):
+    python benchmarks/bench_startup.py --max-ms 800
+    python benchmarks/bench_startup.py --compare benchmarks/results/old_startup.json
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from common import PYTHON_DIR, RESULTS_DIR, compare_results, write_results
+
+SERVICES = ["quiz_service", "chatbot_service"]
+
+# "import time: self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$")
+
+
+def parse_importtime(stderr: str):
+    """Return [(module, cumulative_us, depth)] from -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            entries.append((match.group(4), int(match.group(2)), depth))
+    return entries
+
+
+def measure_once(module: str):
+    env = dict(os.environ, LLM_PROVIDER="stub", PYTHONDONTWRITEBYTECODE="1")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PYTHON_DIR, env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    entries = parse_importtime(completed.stderr)
+    # Top-level entries are everything the interpreter imported for this command
+    total_us = sum(cumulative for _, cumulative, depth in entries if depth == 0)
+    module_us = next((cumulative for name, cumulative, depth in entries if name == module and depth == 0), 0)
+    return total_us, module_us, entries
+
+
+def bench_service(module: str, runs: int, top: int):
+    totals, module_times, heaviest = [], [], {}
+    for _ in range(runs):
+        total_us, module_us, entries = measure_once(module)
+        totals.append(total_us / 1000)
+        module_times.append(module_us / 1000)
+        # Direct imports made while importing the service module
+        for name, cumulative, depth in entries:
+            if depth == 1:
+                heaviest.setdefault(name, []).append(cumulative / 1000)
+    slowest = sorted(
+        ((name, statistics.median(values)) for name, values in heaviest.items()),
+        key=lambda item: item[1], reverse=True,
+    )[:top]
+    return {
+        "runs": runs,
+        "import_total_ms": round(statistics.median(totals), 1),
+        "import_module_ms": round(statistics.median(module_times), 1),
+        "import_total_min_ms": round(min(totals), 1),
+        "slowest_imports": {name: round(ms, 1) for name, ms in slowest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=lambda s: s.split(","), default=SERVICES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to report")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail when a median import exceeds this")
+    parser.add_argument("--output", default=str(RESULTS_DIR / "startup_results.json"))
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.services:
+        results[module] = bench_service(module, args.runs, args.top)
+        print(f"[OK] {module}: {results[module]['import_total_ms']} ms (median of {args.runs})")
+        for name, ms in results[module]["slowest_imports"].items():
+            print(f"       {ms:8.1f} ms  {name}")
+
+    write_results(args.output, "startup", results, {"runs": args.runs, "max_ms": args.max_ms})
+
+    failed = False
+    if args.max_ms is not None:
+        for module, result in results.items():
+            if result["import_total_ms"] > args.max_ms:
+                print(f"[WARN] {module} cold start {result['import_total_ms']} ms exceeds target {args.max_ms} ms")
+                failed = True
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        for line in regressions:
+            print(f"[WARN] regression: {line}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Shared helpers for the benchmark scripts: stats, fixtures and JSON results."""
+
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PYTHON_DIR = Path(__file__).resolve().parent.parent
+# Default location of result files (gitignored)
+RESULTS_DIR = PYTHON_DIR / "benchmarks" / "results"
+
+
+def use_stub_backends(llm_latency_ms: float = 50, tokens_per_sec: float = 0, embedding_latency_ms: float = 0) -> None:
+    """Point both services at the offline stub provider with rate limiting and index persistence disabled.
+
+    Must run before quiz_service / chatbot_service are imported.
+    """
+    os.environ["LLM_PROVIDER"] = "stub"
+    os.environ["STUB_LLM_LATENCY_MS"] = str(llm_latency_ms)
+    os.environ["STUB_LLM_TOKENS_PER_SEC"] = str(tokens_per_sec)
+    os.environ["STUB_EMBEDDING_LATENCY_MS"] = str(embedding_latency_ms)
+    # Build indexes in memory so index_build times real builds, not loads from the on-disk cache
+    os.environ["FAISS_INDEX_STORE"] = "off"
+    for var in ("GEMINI_RPM", "GEMINI_TPM", "GEMINI_LIGHT_RPM", "GEMINI_LIGHT_TPM",
+                "GEMINI_EMBED_RPM", "GEMINI_EMBED_TPM"):
+        os.environ[var] = "0"
+    if str(PYTHON_DIR) not in sys.path:
+        sys.path.insert(0, str(PYTHON_DIR))
+
+
+def summarize(latencies: List[float], wall_seconds: Optional[float] = None, errors: int = 0) -> Dict[str, Any]:
+    """Latency percentiles (ms) and throughput for a list of per-request durations in seconds."""
+    ordered = sorted(latencies)
+
+    def pct(p: float) -> float:
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+        return round(ordered[index] * 1000, 3)
+
+    summary = {
+        "count": len(ordered),
+        "errors": errors,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+    if wall_seconds:
+        summary["wall_s"] = round(wall_seconds, 3)
+        summary["throughput_rps"] = round(len(ordered) / wall_seconds, 2)
+    return summary
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux /proc), falling back to peak RSS elsewhere."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def make_pdf(pages: int, lines_per_page: int = 40) -> bytes:
+    """Build a simple text-only PDF with `pages` pages (no external dependencies)."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        text = "BT /F1 10 Tf 50 780 Td 12 TL " + " ".join(
+            f"(Page {page + 1} line {line + 1}: onboarding policy text for benchmark purposes.) '"
+            for line in range(lines_per_page)
+        ) + " ET"
+        stream = text.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), pages
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def make_png(width: int = 640, height: int = 480) -> bytes:
+    """Build an RGB gradient PNG (no Pillow needed)."""
+    rows = bytearray()
+    for y in range(height):
+        rows.append(0)  # filter type: none
+        for x in range(width):
+            rows += bytes((x * 255 // width, y * 255 // height, 128))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(bytes(rows))) + chunk(b"IEND", b"")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PYTHON_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def write_results(path: str, benchmark: str, results: Dict[str, Any], config: Dict[str, Any]) -> None:
+    payload = {
+        "benchmark": benchmark,
+        "timestamp": datetime.utcnow().isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(payload, indent=2))
+    print(f"[OK] Wrote results to {path}")
+
+
+def _flatten(prefix: str, value: Any, out: Dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), inner, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+# Metrics where a larger value is better; every other *_ms / *_s / *bytes metric is "lower is better"
+HIGHER_IS_BETTER = ("throughput_rps", "pages_per_s", "chars_per_s")
+LOWER_IS_BETTER = ("_ms", "_s", "bytes", "errors")
+
+
+def compare_results(baseline_path: str, current: Dict[str, Any], threshold: float) -> List[str]:
+    """Return a line per metric that regressed by more than `threshold` (fraction) vs. a baseline file."""
+    baseline = json.loads(Path(baseline_path).read_text())["results"]
+    old, new = {}, {}
+    _flatten("", baseline, old)
+    _flatten("", current, new)
+
+    regressions = []
+    for key, before in sorted(old.items()):
+        after = new.get(key)
+        if after is None or before == 0:
+            continue
+        change = (after - before) / abs(before)
+        if key.endswith(HIGHER_IS_BETTER):
+            regressed = change < -threshold
+        elif key.endswith(LOWER_IS_BETTER):
+            regressed = change > threshold
+        else:
+            continue
+        if regressed:
+            regressions.append(f"{key}: {before:g} -> {after:g} ({change:+.0%})")
+    return regressions
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
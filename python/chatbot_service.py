@@ -3,29 +3,44 @@
 """
 Chatbot Service (Gemini + LangChain, CSV Knowledge Base)
 Lightweight version – no PyTorch or Transformers required
+
+pandas, FAISS and the LangChain chain components are imported when the first
+tenant is initialized; provider clients are created in the startup hook.
 """
 
 import os
 import sys
-import pandas as pd
+import asyncio
 import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, List, Any, Union
 from pathlib import Path
 from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request as FastAPIRequest
 from pydantic import BaseModel, Field, validator
 import uvicorn
 
-# LangChain components
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+# LangChain components (light ones only; FAISS and the chain pieces load lazily)
+from langchain_core.embeddings import Embeddings
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableParallel
+
+from llm_provider import get_provider, provider_name
+from llm_scheduler import BACKGROUND, INTERACTIVE, estimate_tokens, get_scheduler, scheduler_stats
+import deadline
+import faiss_store
+import metrics
+import model_router
+from admission import AdmissionController, AdmissionRejected, parse_weights
+from deadline import DeadlineExceeded, hedged_call
+from metrics import record_cache, stage_timer
+from single_flight import SingleFlight
 
 # -------------------------------------------------
 # Logging
@@ -54,20 +69,69 @@ except ImportError:
 # Config
 # -------------------------------------------------
 GOOGLE_API_KEY = os.environ.get("GEMINI_API_KEY")  # Use GEMINI_API_KEY for consistency with quiz_service
-if not GOOGLE_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable must be set")
+if not GOOGLE_API_KEY and provider_name() == "gemini":
+    raise ValueError("GEMINI_API_KEY environment variable must be set (or LLM_PROVIDER=stub for offline testing)")
 
-MODEL_NAME = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+MODEL_NAME = model_router.STANDARD_MODEL  # GEMINI_MODEL; short chats may use GEMINI_LIGHT_MODEL
 EMBEDDING_MODEL = os.environ.get("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
 CSV_PATH = Path(os.environ.get("KNOWLEDGE_BASE_PATH", 
                                str(Path(__file__).parent / "majestic_realistic_knowledge_base.csv")))
 MAX_HISTORY_MESSAGES = int(os.environ.get("MAX_HISTORY_MESSAGES", "20"))
 MAX_HISTORY_AGE_HOURS = int(os.environ.get("MAX_HISTORY_AGE_HOURS", "24"))
+CHAT_OUTPUT_TOKENS = int(os.environ.get("CHAT_OUTPUT_TOKENS", "512"))  # per-answer budget for the TPM limiter
+
+# Startup warm-up: "off", "all" (every company_id in the knowledge base) or a comma-separated hot list
+CHATBOT_WARMUP = os.environ.get("CHATBOT_WARMUP", "off").strip()
+CHATBOT_WARMUP_CONCURRENCY = int(os.environ.get("CHATBOT_WARMUP_CONCURRENCY", "2"))
+CHATBOT_READY_FRACTION = float(os.environ.get("CHATBOT_READY_FRACTION", "1.0"))
+
+# Adaptive retrieval for /chat: keep documents scoring at least RETRIEVAL_MIN_SCORE and within
+# RETRIEVAL_SCORE_MARGIN of the best match, diversify them with MMR and cap at RETRIEVAL_MAX_K.
+# When nothing qualifies the templated CHATBOT_NO_ANSWER_MESSAGE is returned without an LLM call.
+RETRIEVAL_FETCH_K = int(os.environ.get("RETRIEVAL_FETCH_K", "12"))
+RETRIEVAL_MAX_K = int(os.environ.get("RETRIEVAL_MAX_K", "5"))
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "0.45"))
+RETRIEVAL_SCORE_MARGIN = float(os.environ.get("RETRIEVAL_SCORE_MARGIN", "0.15"))
+RETRIEVAL_MMR_LAMBDA = float(os.environ.get("RETRIEVAL_MMR_LAMBDA", "0.7"))
+CHATBOT_NO_ANSWER_MESSAGE = os.environ.get(
+    "CHATBOT_NO_ANSWER_MESSAGE",
+    "I couldn't find information about that in the company knowledge base. "
+    "Please try rephrasing your question, or contact your supervisor for help.",
+)
+
+# Per-company admission control for /chat (see admission.py)
+CHAT_MAX_CONCURRENCY = int(os.environ.get("CHAT_MAX_CONCURRENCY", "16"))
+CHAT_TENANT_MAX_CONCURRENCY = int(os.environ.get("CHAT_TENANT_MAX_CONCURRENCY", "4"))
+CHAT_MAX_QUEUE_WAIT = float(os.environ.get("CHAT_MAX_QUEUE_WAIT", "10"))  # seconds before a fast 503
+CHAT_TENANT_MAX_QUEUE = int(os.environ.get("CHAT_TENANT_MAX_QUEUE", "50"))
+CHAT_TENANT_WEIGHTS = parse_weights(os.environ.get("CHAT_TENANT_WEIGHTS", ""))  # "company_a:2,company_b:0.5"
+
+# /search (retrieval only, no LLM call)
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", "50"))
+SEARCH_QUERY_CACHE_SIZE = int(os.environ.get("SEARCH_QUERY_CACHE_SIZE", "512"))  # query embeddings kept for typeahead
 
 # -------------------------------------------------
 # App setup
 # -------------------------------------------------
-app = FastAPI(title="Gemini Chatbot Service", version="3.0")
+@asynccontextmanager
+async def lifespan(_app):
+    # Create provider clients before serving instead of on the first request
+    await run_in_threadpool(get_llm)
+    if model_router.MODEL_ROUTING:
+        await run_in_threadpool(get_llm, model_router.LIGHT_MODEL)
+    await run_in_threadpool(get_embedding)
+    warmup_task = None
+    targets = await run_in_threadpool(resolve_warmup_targets, CHATBOT_WARMUP)
+    if targets:
+        # Build tenant indexes in the background; the server accepts traffic meanwhile
+        # (/ready reports 503 until enough of them are warm)
+        warmup_targets[:] = targets
+        warmup_task = asyncio.create_task(warm_up_tenants(targets))
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+
+app = FastAPI(title="Gemini Chatbot Service", version="3.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -77,33 +141,142 @@ app.add_middleware(
 )
 
 chatbot_instances: Dict[str, Any] = {}
-vector_stores: Dict[str, FAISS] = {}
+vector_stores: Dict[str, Any] = {}  # company_id -> FAISS
 chat_histories: Dict[str, List] = {}
 chat_history_timestamps: Dict[str, datetime] = {}
+# company_id -> "pending" | "warming" | "ready" | "failed"
+tenant_status: Dict[str, str] = {}
+warmup_targets: List[str] = []
+admission = AdmissionController(
+    total_limit=CHAT_MAX_CONCURRENCY,
+    tenant_limit=CHAT_TENANT_MAX_CONCURRENCY,
+    max_wait=CHAT_MAX_QUEUE_WAIT,
+    max_queue=CHAT_TENANT_MAX_QUEUE,
+    weights=CHAT_TENANT_WEIGHTS,
+)
+
+metrics.install(app)
+deadline.install(app)
+metrics.gauge("chatbot_tenants_loaded", "Companies with an initialized chatbot", function=lambda: len(chatbot_instances))
+metrics.gauge("chatbot_sessions", "Chat histories currently held in memory", function=lambda: len(chat_histories))
+RETRIEVED_DOCS = metrics.histogram("chatbot_retrieved_documents", "Documents placed in the chat prompt",
+                                   buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10))
+NO_CONTEXT_ANSWERS = metrics.counter("chatbot_no_context_answers_total",
+                                     "Chat answers served from the template because nothing relevant was retrieved")
+metrics.gauge(
+    "chatbot_tenants", "Tenants by warm-up state", ("state",),
+    function=lambda: {(state,): list(tenant_status.values()).count(state) for state in ("pending", "warming", "ready", "failed")},
+)
 
 # -------------------------------------------------
 # Data loading helpers
 # -------------------------------------------------
 
-def load_csv_knowledge(company_id: str) -> List[str]:
+def load_csv_entries(company_id: str) -> List[Dict[str, str]]:
+    """Knowledge base rows for a company as {id, question, answer, category} dicts."""
     if not CSV_PATH.exists():
         return []
+    import pandas as pd
     try:
-        df = pd.read_csv(CSV_PATH)
+        with stage_timer("csv_load"):
+            df = pd.read_csv(CSV_PATH)
     except Exception as e:
         logger.error(f"❌ Failed to read CSV knowledge base: {e}")
         return []
     company_df = df[df["company_id"] == company_id].copy()
     if company_df.empty:
         return []
-    return (company_df["question"] + " " + company_df["answer"]).tolist()
+    company_df = company_df.fillna("")
+    return [
+        {
+            "id": str(row.get("_id", "")),
+            "question": str(row["question"]),
+            "answer": str(row["answer"]),
+            "category": str(row.get("category", "")),
+        }
+        for row in company_df.to_dict("records")
+    ]
+
+
+def load_csv_knowledge(company_id: str) -> List[str]:
+    return [f"{e['question']} {e['answer']}" for e in load_csv_entries(company_id)]
+
+
+def list_company_ids() -> List[str]:
+    """All company_ids present in the CSV knowledge base."""
+    if not CSV_PATH.exists():
+        return []
+    import pandas as pd
+    try:
+        with stage_timer("csv_load"):
+            df = pd.read_csv(CSV_PATH, usecols=["company_id"])
+    except Exception as e:
+        logger.error(f"❌ Failed to read CSV knowledge base: {e}")
+        return []
+    return sorted(df["company_id"].dropna().astype(str).unique().tolist())
+
+
+NO_KNOWLEDGE_BASE = "No knowledge base available for this company."
+
+
+def build_knowledge_corpus(company_id: str):
+    """Texts to index plus per-text metadata (the KB row, used by /search)."""
+    entries = load_csv_entries(company_id)
+    if not entries:
+        return [NO_KNOWLEDGE_BASE], [{}]
+    return [f"{e['question']} {e['answer']}" for e in entries], entries
+
+class ScheduledEmbeddings(Embeddings):
+    """Routes embedding calls through the shared Gemini rate limiter.
+
+    Index builds (embed_documents) are background work; query embeddings
+    are on the interactive chat path.
+    """
 
+    def __init__(self, inner: Embeddings):
+        self.inner = inner
 
-def build_knowledge_corpus(company_id: str) -> List[str]:
-    chunks = load_csv_knowledge(company_id)
-    if not chunks:
-        return ["No knowledge base available for this company."]
-    return chunks
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        def call():
+            with stage_timer("embedding"):
+                return self.inner.embed_documents(texts)
+
+        return get_scheduler("embed").call(
+            call,
+            priority=BACKGROUND,
+            tokens=estimate_tokens(texts),
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        def call():
+            with stage_timer("embedding"):
+                return self.inner.embed_query(text)
+
+        return get_scheduler("embed").call(
+            call,
+            priority=INTERACTIVE,
+            tokens=estimate_tokens(text),
+        )
+
+# Provider clients shared by every tenant
+_llms: Dict[str, Any] = {}  # model name -> chat model
+_embedding = None
+_clients_lock = threading.Lock()
+
+def get_llm(model_name: str = MODEL_NAME):
+    with _clients_lock:
+        if model_name not in _llms:
+            _llms[model_name] = get_provider().chat_model(model_name, temperature=0.7)
+        return _llms[model_name]
+
+def get_embedding() -> "ScheduledEmbeddings":
+    global _embedding
+    with _clients_lock:
+        if _embedding is None:
+            provider = get_provider()
+            logger.info(f"🔢 Creating {provider.display_name} embeddings with model: {EMBEDDING_MODEL}")
+            _embedding = ScheduledEmbeddings(provider.embeddings(EMBEDDING_MODEL))
+        return _embedding
 
 # -------------------------------------------------
 # Request/Response Models
@@ -153,8 +326,19 @@ def cleanup_old_histories():
 # -------------------------------------------------
 # Initialization
 # -------------------------------------------------
+# Concurrent first requests (and warm-up) for one company share a single index build
+index_flight = SingleFlight("index_build")
+
 def initialize_chatbot(company_id: str):
     if company_id in chatbot_instances:
+        record_cache("chatbot_instance", True)
+        return chatbot_instances[company_id]
+    record_cache("chatbot_instance", False)
+    return index_flight.do(company_id, lambda: _build_chatbot(company_id))
+
+def _build_chatbot(company_id: str):
+    if company_id in chatbot_instances:
+        # Finished by another caller between the cache check and joining the flight
         return chatbot_instances[company_id]
     
     logger.info(f"🤖 Initializing chatbot for {company_id}")
@@ -162,21 +346,63 @@ def initialize_chatbot(company_id: str):
     if not CSV_PATH.exists():
         raise FileNotFoundError(f"Knowledge base not found: {CSV_PATH}")
     
-    texts = build_knowledge_corpus(company_id)
+    texts, metadatas = build_knowledge_corpus(company_id)
+    
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnableParallel
     
     # ---- GEMINI Embeddings (no Torch) ----
-    logger.info(f"🔢 Creating Google Gemini embeddings with model: {EMBEDDING_MODEL}")
-    embedding = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=GOOGLE_API_KEY)
-    db = FAISS.from_texts(texts, embedding)
-    retriever = db.as_retriever(search_kwargs={"k": 3})
+    embedding = get_embedding()
+    # Saved indexes are memory-mapped and shared with the other workers (see faiss_store.py);
+    # the placeholder of an unknown company is never written to disk
+    db = faiss_store.load_or_build(company_id, texts, metadatas, embedding, f"{provider_name()}:{EMBEDDING_MODEL}",
+                                   persist=texts != [NO_KNOWLEDGE_BASE])
     vector_stores[company_id] = db
     
-    llm = ChatGoogleGenerativeAI(model=MODEL_NAME, google_api_key=GOOGLE_API_KEY, temperature=0.7)
+    def call_llm(prompt_value):
+        input_tokens = estimate_tokens(prompt_value)
+        tokens = input_tokens + CHAT_OUTPUT_TOKENS
+        # Short FAQ-style prompts may go to the light model (see model_router.py)
+        route = model_router.route("chat", input_tokens, budget_tokens=tokens)
+        scheduler = get_scheduler(route.scheduler)
+        llm = get_llm(route.model)
+        
+        def call():
+            start = time.perf_counter()
+            with stage_timer("llm_call"):
+                message = llm.invoke(prompt_value)
+            model_router.record_call("chat", route.model, time.perf_counter() - start, message, input_tokens)
+            return message
+
+        # Slow calls are hedged with a duplicate when quota allows (see deadline.py)
+        hedge_name = "chat_generate" if route.tier == model_router.STANDARD else "chat_generate_light"
+        return scheduler.call(
+            lambda: hedged_call(hedge_name, call, lambda: scheduler.try_acquire(tokens)),
+            priority=INTERACTIVE,
+            tokens=tokens,
+        )
     
     
     def format_docs(docs):
         return "\n\n".join([doc.page_content for doc in docs])
     
+    def retrieve(question: str, user_id: Optional[str] = None):
+        docs = adaptive_search(db, embedding.embed_query(question))
+        if not docs:
+            # Follow-ups ("what about the second one?") rarely match on their own;
+            # retry once with the user's previous question for context
+            previous = [m.content for m in chat_histories.get(user_id) or [] if isinstance(m, HumanMessage)]
+            if len(previous) > 1:
+                docs = adaptive_search(db, embedding.embed_query(f"{previous[-2]} {question}"))
+        RETRIEVED_DOCS.observe(len(docs))
+        return docs
+    
+    def no_context_answer(_input_dict):
+        NO_CONTEXT_ANSWERS.inc()
+        logger.info("📭 Nothing relevant in the knowledge base; answering without the LLM")
+        return CHATBOT_NO_ANSWER_MESSAGE
+    
     prompt_template = """You are a helpful AI assistant for the company. 
 Answer the user's question using the information provided in the context below.
 
@@ -203,29 +429,177 @@ Answer:"""
             )
         
         return {
-            "context": input_dict.get("context", ""),
+            "context": format_docs(input_dict.get("context") or []),
             "question": input_dict.get("question", ""),
             "chat_history": history_str
         }
     
+    def assemble_prompt(input_dict):
+        with stage_timer("prompt_assembly"):
+            return prompt.invoke(build_input(input_dict))
+    
     # Create the chain using RunnableParallel for proper LCEL syntax
     # RunnableParallel runs multiple runnables in parallel and combines their outputs
     # The input to invoke() should be {"question": "..."}, and RunnableParallel will pass it to both branches
+    # When retrieval finds nothing relevant, RunnableBranch skips the prompt and LLM call entirely
+    answer_chain = RunnableLambda(assemble_prompt) | RunnableLambda(call_llm) | StrOutputParser()
     chatbot = (
         RunnableParallel({
-            "context": RunnableLambda(lambda x: format_docs(retriever.invoke(x.get("question", "")))),
+            "context": RunnableLambda(lambda x: retrieve(x.get("question", ""), x.get("user_id"))),
             "question": RunnableLambda(lambda x: x.get("question", "")),
             "user_id": RunnableLambda(lambda x: x.get("user_id"))
         })
-        | RunnableLambda(build_input)
-        | prompt
-        | llm
-        | StrOutputParser()
+        | RunnableBranch(
+            (lambda x: not x["context"], RunnableLambda(no_context_answer)),
+            answer_chain,
+        )
     )
     
     chatbot_instances[company_id] = chatbot
+    tenant_status[company_id] = "ready"
     return chatbot
 
+# -------------------------------------------------
+# Retrieval-only search
+# -------------------------------------------------
+_query_vectors: "OrderedDict[str, List[float]]" = OrderedDict()
+_query_vectors_lock = threading.Lock()
+
+def embed_search_query(query: str) -> List[float]:
+    """Query embedding with a small LRU cache (typeahead repeats the same prefixes)."""
+    key = " ".join(query.lower().split())
+    with _query_vectors_lock:
+        vector = _query_vectors.get(key)
+        if vector is not None:
+            _query_vectors.move_to_end(key)
+    record_cache("search_query_embedding", vector is not None)
+    if vector is None:
+        vector = get_embedding().embed_query(key)
+        if SEARCH_QUERY_CACHE_SIZE > 0:
+            with _query_vectors_lock:
+                _query_vectors[key] = vector
+                while len(_query_vectors) > SEARCH_QUERY_CACHE_SIZE:
+                    _query_vectors.popitem(last=False)
+    return vector
+
+def similarity_from_distance(distance: float) -> float:
+    """Cosine similarity from FAISS' squared L2 distance (embeddings are unit length)."""
+    return 1.0 - float(distance) / 2.0
+
+def adaptive_search(db, query_vector: List[float]) -> List[Any]:
+    """Documents for the chat prompt, with k chosen from the similarity scores.
+
+    Candidates must score at least RETRIEVAL_MIN_SCORE and be within
+    RETRIEVAL_SCORE_MARGIN of the best match; the survivors are re-ranked
+    with MMR for diversity and capped at RETRIEVAL_MAX_K. May return [].
+    """
+    import numpy as np
+    from langchain_community.vectorstores.utils import maximal_marginal_relevance
+    
+    with stage_timer("faiss_search"):
+        query = np.array([query_vector], dtype=np.float32)
+        distances, indices = db.index.search(query, min(RETRIEVAL_FETCH_K, db.index.ntotal))
+        scored = [(int(i), similarity_from_distance(d)) for d, i in zip(distances[0], indices[0]) if i != -1]
+        if not scored:
+            return []
+        best = max(score for _, score in scored)
+        cutoff = max(RETRIEVAL_MIN_SCORE, best - RETRIEVAL_SCORE_MARGIN)
+        candidates = [i for i, score in scored if score >= cutoff]
+        if len(candidates) > 1:
+            vectors = [db.index.reconstruct(i) for i in candidates]
+            order = maximal_marginal_relevance(query, vectors, k=min(RETRIEVAL_MAX_K, len(candidates)),
+                                               lambda_mult=RETRIEVAL_MMR_LAMBDA)
+            candidates = [candidates[j] for j in order]
+        docs = [db.docstore.search(db.index_to_docstore_id[i]) for i in candidates]
+    # The placeholder indexed for companies without a knowledge base carries no metadata
+    return [doc for doc in docs if doc.metadata.get("question")]
+
+def search_knowledge_base(company_id: str, query: str, limit: int = 10, offset: int = 0,
+                          categories: Optional[List[str]] = None, min_score: float = 0.0) -> Dict[str, Any]:
+    """Top KB entries for a query from the company's vector store, without calling the LLM."""
+    initialize_chatbot(company_id)
+    db = vector_stores[company_id]
+    vector = embed_search_query(query)
+    wanted = {c.strip().lower() for c in categories or [] if c.strip()}
+    
+    total = db.index.ntotal
+    # A flat index scans every vector regardless of k, so fetching more costs little;
+    # with a category filter fetch everything so pages stay complete
+    k = total if wanted else min(total, offset + limit + 1)
+    with stage_timer("faiss_search"):
+        hits = db.similarity_search_with_score_by_vector(vector, k=k)
+    
+    matches = []
+    for doc, distance in hits:
+        entry = doc.metadata
+        score = similarity_from_distance(distance)
+        if not entry.get("question") or score < min_score:
+            continue
+        if wanted and entry.get("category", "").lower() not in wanted:
+            continue
+        matches.append({
+            "id": entry.get("id"),
+            "question": entry["question"],
+            "answer": entry["answer"],
+            "category": entry.get("category", ""),
+            "score": round(score, 4),
+        })
+    page = matches[offset:offset + limit]
+    return {
+        "results": page,
+        "offset": offset,
+        "limit": limit,
+        "has_more": len(matches) > offset + limit,
+    }
+
+# -------------------------------------------------
+# Startup warm-up
+# -------------------------------------------------
+def resolve_warmup_targets(setting: str) -> List[str]:
+    """Company ids to warm for a CHATBOT_WARMUP / --warmup setting."""
+    if not setting or setting.lower() in ("off", "false", "0", "none"):
+        return []
+    if setting.lower() == "all":
+        return list_company_ids()
+    return [cid.strip() for cid in setting.split(",") if cid.strip()]
+
+
+async def warm_up_tenants(company_ids: List[str]):
+    """Build retrievers for company_ids in the background, CHATBOT_WARMUP_CONCURRENCY at a time."""
+    warmup_targets[:] = company_ids
+    for cid in company_ids:
+        tenant_status.setdefault(cid, "pending")
+    semaphore = asyncio.Semaphore(max(1, CHATBOT_WARMUP_CONCURRENCY))
+    logger.info(f"🔥 Warming {len(company_ids)} tenant(s) with concurrency {CHATBOT_WARMUP_CONCURRENCY}")
+
+    async def warm(cid: str):
+        async with semaphore:
+            if tenant_status.get(cid) == "ready":
+                return
+            tenant_status[cid] = "warming"
+            try:
+                await run_in_threadpool(initialize_chatbot, cid)
+            except Exception as e:
+                tenant_status[cid] = "failed"
+                logger.error(f"❌ Warm-up failed for {cid}: {e}")
+
+    await asyncio.gather(*(warm(cid) for cid in company_ids))
+    ready = sum(1 for cid in company_ids if tenant_status.get(cid) == "ready")
+    logger.info(f"🔥 Warm-up finished: {ready}/{len(company_ids)} tenants ready")
+
+
+def readiness() -> Dict[str, Any]:
+    targets = list(warmup_targets)
+    ready = sum(1 for cid in targets if tenant_status.get(cid) == "ready")
+    fraction = ready / len(targets) if targets else 1.0
+    return {
+        "ready": fraction >= CHATBOT_READY_FRACTION,
+        "warm_fraction": round(fraction, 3),
+        "required_fraction": CHATBOT_READY_FRACTION,
+        "warm_tenants": ready,
+        "warmup_targets": len(targets),
+    }
+
 # -------------------------------------------------
 # API Endpoints
 # -------------------------------------------------
@@ -234,18 +608,52 @@ async def health():
     return {
         "status": "ok",
         "active_companies": len(chatbot_instances),
-        "embedding_backend": "Google Gemini",
+        "llm_provider": provider_name(),
+        "embedding_backend": get_provider().display_name,
         "embedding_model": EMBEDDING_MODEL,
         "llm_model": MODEL_NAME,
+        "model_routing": model_router.stats(),
+        "rate_limiter": scheduler_stats(),
+        "admission": admission.stats(),
+        "readiness": readiness(),
+        "single_flight": index_flight.stats(),
+        "hedging": deadline.stats(),
+        "faiss_index_store": faiss_store.FAISS_INDEX_STORE,
+        "tenants": dict(tenant_status),
         "timestamp": datetime.utcnow().isoformat(),
     }
 
-@app.post("/chat", response_model=ChatResponse, responses={500: {"model": ErrorResponse}})
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the configured fraction of warm-up tenants is built."""
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+@app.post("/chat", response_model=ChatResponse,
+          responses={500: {"model": ErrorResponse}, 503: {"model": ErrorResponse}, 504: {"model": ErrorResponse}})
 async def chat(request: ChatRequest):
+    logger.info(f"📥 Received chat request - company_id={request.company_id}, user_id={request.user_id}, query_length={len(request.query)}")
+    try:
+        # Fair share of capacity per company; shed load early instead of queueing forever
+        # Never queue longer than the caller's remaining budget allows
+        left = deadline.remaining()
+        max_wait = None if left is None else max(0.0, left - deadline.DEADLINE_MIN_REMAINING)
+        async with admission.slot(request.company_id.strip(), max_wait=max_wait):
+            return await _handle_chat(request)
+    except AdmissionRejected as e:
+        logger.warning(f"🚦 Rejected chat for company {request.company_id} ({e.reason}); retry after {e.retry_after}s")
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "The assistant is busy right now. Please try again shortly.", "ok": False},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+async def _handle_chat(request: ChatRequest) -> ChatResponse:
     try:
-        logger.info(f"📥 Received chat request - company_id={request.company_id}, user_id={request.user_id}, query_length={len(request.query)}")
         cleanup_old_histories()
-        bot = initialize_chatbot(request.company_id)
+        # Index builds and LLM calls block (and may wait on the rate limiter),
+        # so they run in the threadpool rather than on the event loop
+        bot = await run_in_threadpool(initialize_chatbot, request.company_id)
         actual_user_id = request.user_id.strip() if request.user_id else None
         company_key = request.company_id.strip()
         chat_key = actual_user_id or company_key
@@ -257,7 +665,7 @@ async def chat(request: ChatRequest):
         
         chat_histories.setdefault(chat_key, [])
         chat_histories[chat_key].append(HumanMessage(content=request.query))
-        answer = bot.invoke({
+        answer = await run_in_threadpool(bot.invoke, {
             "question": request.query,
             "user_id": chat_key
         })
@@ -265,10 +673,40 @@ async def chat(request: ChatRequest):
         chat_histories[chat_key] = chat_histories[chat_key][-MAX_HISTORY_MESSAGES:]
         
         return ChatResponse(answer=answer, conversation_id=request.conversation_id)
+    except DeadlineExceeded as e:
+        logger.warning(f"⏱️ {e}")
+        raise HTTPException(status_code=504, detail={"error": "The assistant took too long to answer. Please try again.", "ok": False})
     except Exception as e:
         logger.error(f"Error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail={"error": str(e), "ok": False})
 
+@app.get("/search")
+async def search(
+    company_id: str,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1),
+    offset: int = Query(0, ge=0),
+    category: Optional[str] = None,
+    min_score: float = Query(0.0, ge=-1.0, le=1.0),
+):
+    """Retrieval-only lookup: top knowledge base entries with similarity scores, no LLM call.
+    
+    category accepts a comma-separated list; results are paginated with limit/offset.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q cannot be empty")
+    try:
+        start = datetime.now()
+        result = await run_in_threadpool(
+            search_knowledge_base, company_id.strip(), q.strip(), min(limit, SEARCH_MAX_LIMIT), offset,
+            category.split(",") if category else None, min_score,
+        )
+        result["took_ms"] = round((datetime.now() - start).total_seconds() * 1000, 1)
+        return result
+    except Exception as e:
+        logger.error(f"Search error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail={"error": str(e), "ok": False})
+
 @app.post("/chat/reset")
 async def reset_chat(request: FastAPIRequest):
     try:
@@ -322,8 +760,12 @@ if __name__ == "__main__":
     parser.add_argument("--serve", action="store_true")
     parser.add_argument("--port", type=int, default=8002)
     parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--warmup", type=str, default=None,
+                        help="warm tenant indexes at startup: 'all' or comma-separated company_ids")
     
     args = parser.parse_args()
+    if args.warmup is not None:
+        CHATBOT_WARMUP = args.warmup
     
     if args.serve:
         logger.info(f"Starting Chatbot API server on http://{args.host}:{args.port}")
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+"""Request deadlines and hedged Gemini calls.
+
+Deadlines: a caller (the Node proxy) sends its remaining time budget in the
+X-Request-Budget-Ms header. DeadlineMiddleware turns it into a deadline held
+in a context variable, which follows the request into threadpool workers.
+LLM calls check it before starting and while waiting for quota, and fail
+fast with DeadlineExceeded instead of doing work the client will not wait
+for.
+
+Hedging: hedged_call() runs an LLM call and, if it has not finished after
+the LLM_HEDGE_PERCENTILE latency of recent calls with the same name, starts
+an identical backup call and returns whichever succeeds first. The backup
+only runs when the rate limiter has quota to spare right now, so hedges
+never queue ahead of real work. Synchronous SDK calls cannot be interrupted,
+so the losing call is abandoned: its result is discarded.
+
+Calls that cannot be hedged run inline on the caller's thread. A call that
+may be hedged runs on its own thread, so the caller is free to return the
+hedge's result; only the backups use the shared pool of LLM_HEDGE_WORKERS
+threads, and a hedge is skipped when every worker is busy. stats() (in
+/health) shows the threads in use, including abandoned calls still running.
+
+Environment variables:
+    LLM_HEDGE                   - "true" (default) or "false"
+    LLM_HEDGE_PERCENTILE        - latency percentile that triggers a hedge (default 95)
+    LLM_HEDGE_MIN_DELAY_MS      - never hedge earlier than this (default 1000)
+    LLM_HEDGE_MIN_SAMPLES       - calls observed before hedging starts (default 20)
+    LLM_HEDGE_WORKERS           - threads running backup calls (default 32)
+    DEADLINE_MIN_REMAINING_MS   - fail fast below this remaining budget (default 500)
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+from metrics import counter, gauge, histogram
+
+T = TypeVar("T")
+
+REQUEST_BUDGET_HEADER = "x-request-budget-ms"
+
+LLM_HEDGE = os.getenv("LLM_HEDGE", "true").strip().lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", "1000")) / 1000
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "32"))
+DEADLINE_MIN_REMAINING = float(os.getenv("DEADLINE_MIN_REMAINING_MS", "500")) / 1000
+
+HEDGES = counter("llm_hedges_total", "Hedged LLM calls by outcome", ("call", "outcome"))
+HEDGED_CALLS = counter("llm_hedgeable_calls_total", "LLM calls eligible for hedging", ("call",))
+DEADLINE_EXCEEDED = counter("deadline_exceeded_total", "Work abandoned because the request deadline passed",
+                            ("where",))
+CALL_LATENCY = histogram("llm_call_attempt_seconds", "Latency of individual LLM call attempts", ("call",))
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None without a deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(where: str, needed: float = DEADLINE_MIN_REMAINING) -> None:
+    """Raise DeadlineExceeded when less than `needed` seconds remain."""
+    left = remaining()
+    if left is not None and left < needed:
+        DEADLINE_EXCEEDED.inc(where=where)
+        raise DeadlineExceeded(f"Request deadline exceeded ({where}; {max(left, 0) * 1000:.0f} ms left)")
+
+
+@contextmanager
+def deadline_scope(budget_seconds: Optional[float]):
+    """Apply a deadline `budget_seconds` from now (never extending an existing, tighter one)."""
+    if budget_seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + budget_seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def detached():
+    """Run without any request deadline (background work that outlives the request)."""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# -------------------------------------------------
+# Hedging
+# -------------------------------------------------
+class _LatencyWindow:
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+_windows: Dict[str, _LatencyWindow] = {}
+_windows_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+# Threads currently running LLM calls that may be hedged, by kind
+_running = {"primary": 0, "hedge": 0}
+_skipped_pool_full = 0
+
+
+def _window(name: str) -> _LatencyWindow:
+    with _windows_lock:
+        return _windows.setdefault(name, _LatencyWindow())
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _windows_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        return _pool
+
+
+def hedge_delay(name: str) -> Optional[float]:
+    """Seconds to wait before hedging a call, or None when hedging is off / not enough data."""
+    if not LLM_HEDGE:
+        return None
+    p = _window(name).percentile(LLM_HEDGE_PERCENTILE)
+    return None if p is None else max(p, LLM_HEDGE_MIN_DELAY)
+
+
+def _timed(name: str, fn: Callable[[], T]) -> Callable[[], T]:
+    def run():
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        _window(name).add(elapsed)
+        CALL_LATENCY.observe(elapsed, call=name)
+        return result
+    return run
+
+
+def _release(kind: str) -> None:
+    with _windows_lock:
+        _running[kind] -= 1
+
+
+def _start_primary(name: str, fn: Callable[[], T]) -> Future:
+    """Run fn on a new thread with the caller's context (deadline, etc.)."""
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(context.run(fn))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            _release("primary")
+
+    with _windows_lock:
+        _running["primary"] += 1
+    threading.Thread(target=run, name=f"llm-{name}", daemon=True).start()
+    return future
+
+
+def _reserve_hedge() -> bool:
+    """Claim a hedge worker; False when every worker is busy."""
+    global _skipped_pool_full
+    with _windows_lock:
+        if _running["hedge"] >= LLM_HEDGE_WORKERS:
+            _skipped_pool_full += 1
+            return False
+        _running["hedge"] += 1
+        return True
+
+
+def _start_hedge(fn: Callable[[], T]) -> Future:
+    """Submit fn to the hedge pool on a worker claimed with _reserve_hedge()."""
+    future = _get_pool().submit(contextvars.copy_context().run, fn)
+    future.add_done_callback(lambda _: _release("hedge"))
+    return future
+
+
+def hedged_call(name: str, fn: Callable[[], T], can_hedge: Callable[[], bool] = lambda: True) -> T:
+    """Run fn(), hedging with a second fn() when it is slower than usual.
+
+    can_hedge() is asked right before launching the backup (e.g. to take
+    rate-limit quota without waiting); returning False skips the hedge.
+    Respects the request deadline; raises DeadlineExceeded when it passes.
+    """
+    check(name)
+    delay = hedge_delay(name)
+    if delay is None:
+        # Nothing to race against: run inline with no thread hop. The SDK call
+        # cannot be interrupted, so the deadline was enforced before starting.
+        return _timed(name, fn)()
+
+    HEDGED_CALLS.inc(call=name)
+    primary = _start_primary(name, _timed(name, fn))
+    futures = [primary]
+    left = remaining()
+    done, _ = wait(futures, timeout=delay if left is None else min(delay, left))
+
+    if not done and (left is None or remaining() > DEADLINE_MIN_REMAINING):
+        # Claim a worker before taking quota, so a skipped hedge never uses quota
+        if not _reserve_hedge():
+            HEDGES.inc(call=name, outcome="skipped_pool_full")
+        elif not can_hedge():
+            _release("hedge")
+            HEDGES.inc(call=name, outcome="skipped_no_quota")
+        else:
+            HEDGES.inc(call=name, outcome="launched")
+            futures.append(_start_hedge(_timed(name, fn)))
+
+    error = None
+    pending = set(futures)
+    while pending:
+        left = remaining()
+        done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+        if not done:
+            break  # deadline passed
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()  # no-op once running; its result is discarded
+                if len(futures) > 1:
+                    HEDGES.inc(call=name, outcome="hedge_won" if future is not primary else "primary_won")
+                return future.result()
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    DEADLINE_EXCEEDED.inc(where=name)
+    raise DeadlineExceeded(f"Request deadline exceeded while waiting for {name}")
+
+
+def stats() -> Dict[str, Any]:
+    """Hedging threads in use; calls abandoned by their caller still count until they return."""
+    with _windows_lock:
+        return {
+            "enabled": LLM_HEDGE,
+            "hedge_workers": LLM_HEDGE_WORKERS,
+            "hedges_running": _running["hedge"],
+            "primaries_running": _running["primary"],
+            "skipped_pool_full": _skipped_pool_full,
+        }
+
+
+def _thread_counts():
+    with _windows_lock:
+        return {(kind,): n for kind, n in _running.items()}
+
+
+gauge("llm_hedge_threads", "Threads running LLM calls that may be hedged", ("kind",), _thread_counts)
+
+
+# -------------------------------------------------
+# ASGI integration
+# -------------------------------------------------
+class DeadlineMiddleware:
+    """Pure ASGI middleware: X-Request-Budget-Ms header -> request deadline."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        budget = None
+        if scope["type"] == "http":
+            for key, value in scope.get("headers", []):
+                if key.decode("latin-1").lower() == REQUEST_BUDGET_HEADER:
+                    try:
+                        budget = max(0.0, float(value.decode("latin-1")) / 1000)
+                    except ValueError:
+                        budget = None
+                    break
+        with deadline_scope(budget):
+            await self.app(scope, receive, send)
+
+
+def install(app) -> None:
+    app.add_middleware(DeadlineMiddleware)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""On-disk tenant FAISS indexes shared by chatbot worker processes.
+
+With several uvicorn workers every process used to embed the knowledge base
+and hold its own copy of each tenant's vectors. Instead, the first worker to
+need a tenant builds its index and writes it to FAISS_INDEX_DIR:
+    <key>.faiss   the raw FAISS index
+    <key>.json    the docstore: page text and KB metadata per vector position
+
+Every worker then opens the .faiss file read-only with memory mapping, so
+the vectors live once in the page cache and are shared by all processes on
+the host; only the small docstore is kept per process. The key is a hash of
+the company followed by a hash of the embedding model and knowledge base
+rows, so edited rows get a fresh index and an unchanged knowledge base is
+never re-embedded, even across restarts. Builds of the same key are
+serialized with a file lock. Once a new index is saved, the company's
+superseded files are deleted; workers that still map an old index keep
+reading it until they reload.
+
+Environment variables:
+    FAISS_INDEX_DIR     - storage directory (default ./faiss_indexes)
+    FAISS_INDEX_STORE   - mmap (default): share vectors via memory mapping
+                          memory: persist, but load a private copy per process
+                          off: build in memory per process, nothing on disk
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from metrics import counter, stage_timer
+
+FAISS_INDEX_DIR = Path(os.getenv("FAISS_INDEX_DIR", str(Path(__file__).parent / "faiss_indexes")))
+FAISS_INDEX_STORE = os.getenv("FAISS_INDEX_STORE", "mmap").strip().lower()
+
+logger = logging.getLogger(__name__)
+
+INDEX_LOADS = counter("faiss_index_loads_total", "Tenant FAISS indexes by how they were obtained", ("source",))
+
+
+def _company_prefix(company_id: str) -> str:
+    return hashlib.sha256(company_id.encode("utf-8")).hexdigest()[:16]
+
+
+def index_key(company_id: str, embedding_id: str, texts: List[str], metadatas: List[Dict[str, Any]]) -> str:
+    """Key of one tenant's index for one embedding model: <company hash>-<content hash>."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([company_id, embedding_id, texts, metadatas], ensure_ascii=False,
+                             sort_keys=True).encode("utf-8"))
+    return f"{_company_prefix(company_id)}-{digest.hexdigest()[:32]}"
+
+
+def remove_superseded(company_id: str, key: str) -> int:
+    """Delete the company's index files other than `key`; returns how many files were removed."""
+    removed = 0
+    for path in FAISS_INDEX_DIR.glob(f"{_company_prefix(company_id)}-*"):
+        if path.stem == key or path.suffix not in (".faiss", ".json", ".lock"):
+            continue
+        try:
+            path.unlink()
+            removed += 1
+        except OSError as e:
+            logger.warning(f"⚠️ Could not remove superseded FAISS file {path.name}: {e}")
+    return removed
+
+
+def _lock_build(key: str):
+    """Open and exclusively lock the build lock file across processes.
+
+    Returns the open file (None where fcntl is unavailable); raises OSError
+    when the index directory cannot be created or written.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    FAISS_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    f = open(FAISS_INDEX_DIR / f"{key}.lock", "w")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX)
+    except OSError:
+        f.close()
+        raise
+    return f
+
+
+def _unlock_build(f) -> None:
+    if f is not None:
+        import fcntl
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+class _SidecarDocstore:
+    """Read-only docstore over the parsed sidecar; Documents are created on lookup."""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self._entries = entries
+
+    def search(self, search: str):
+        from langchain_core.documents import Document
+
+        try:
+            entry = self._entries[int(search)]
+        except (ValueError, IndexError):
+            return f"ID {search} not found."
+        return Document(page_content=entry["text"], metadata=entry["metadata"])
+
+    def delete(self, ids: List) -> None:
+        raise NotImplementedError("Saved FAISS indexes are read-only")
+
+
+def _read_index(path: Path):
+    import faiss
+
+    if FAISS_INDEX_STORE == "mmap":
+        try:
+            # In-file compute: searches read the mapped file directly, no private copy
+            return faiss.read_index(str(path), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY), "mmap"
+        except (AttributeError, RuntimeError):
+            pass  # older faiss, or an index type that cannot be mapped
+    return faiss.read_index(str(path)), "memory"
+
+
+def load(key: str, embedding, record: bool = True) -> Optional[Any]:
+    """Open a saved index as a LangChain FAISS store, or None when it is missing or incomplete."""
+    index_path = FAISS_INDEX_DIR / f"{key}.faiss"
+    docstore_path = FAISS_INDEX_DIR / f"{key}.json"
+    if not index_path.exists() or not docstore_path.exists():
+        return None
+
+    from langchain_community.vectorstores import FAISS
+
+    with stage_timer("index_load"):
+        with open(docstore_path, encoding="utf-8") as f:
+            entries = json.load(f)["documents"]
+        index, source = _read_index(index_path)
+    if index.ntotal != len(entries):
+        return None
+    if record:
+        INDEX_LOADS.inc(source=source)
+    # Positions double as docstore ids; only this lookup table is per process
+    return FAISS(embedding, index, _SidecarDocstore(entries), {i: str(i) for i in range(len(entries))})
+
+
+def save(key: str, db, texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+    """Write the index and its docstore; each file is renamed into place once complete."""
+    import faiss
+
+    FAISS_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    documents = [{"text": t, "metadata": m} for t, m in zip(texts, metadatas)]
+    fd, tmp = tempfile.mkstemp(dir=FAISS_INDEX_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"documents": documents}, f, ensure_ascii=False)
+    os.replace(tmp, FAISS_INDEX_DIR / f"{key}.json")
+
+    fd, tmp = tempfile.mkstemp(dir=FAISS_INDEX_DIR, suffix=".tmp")
+    os.close(fd)
+    faiss.write_index(db.index, tmp)
+    os.replace(tmp, FAISS_INDEX_DIR / f"{key}.faiss")
+
+
+def _build_in_memory(texts: List[str], metadatas: List[Dict[str, Any]], embedding):
+    from langchain_community.vectorstores import FAISS
+
+    with stage_timer("index_build"):
+        db = FAISS.from_texts(texts, embedding, metadatas=metadatas)
+    INDEX_LOADS.inc(source="built")
+    return db
+
+
+def load_or_build(company_id: str, texts: List[str], metadatas: List[Dict[str, Any]], embedding,
+                  embedding_id: str, persist: bool = True):
+    """The tenant's vector store: from disk when saved, otherwise embedded, saved and reopened.
+
+    persist=False builds in memory only (e.g. the placeholder index of a company
+    without a knowledge base). Falls back to a per-process in-memory build when
+    FAISS_INDEX_DIR is unusable.
+    """
+    if FAISS_INDEX_STORE == "off" or not persist:
+        return _build_in_memory(texts, metadatas, embedding)
+
+    key = index_key(company_id, embedding_id, texts, metadatas)
+    try:
+        db = load(key, embedding)
+        if db is not None:
+            return db
+        lock = _lock_build(key)
+    except OSError as e:
+        logger.warning(f"⚠️ FAISS index directory {FAISS_INDEX_DIR} is unusable ({e}); "
+                       f"building the index for {company_id} in memory")
+        return _build_in_memory(texts, metadatas, embedding)
+
+    try:
+        # Another worker may have finished the build while we waited for the lock
+        try:
+            db = load(key, embedding)
+        except OSError:
+            db = None
+        if db is not None:
+            return db
+        built = _build_in_memory(texts, metadatas, embedding)
+        try:
+            save(key, built, texts, metadatas)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not save FAISS index for {company_id}: {e}")
+            return built
+        removed = remove_superseded(company_id, key)
+        if removed:
+            logger.info(f"🧹 Removed {removed} superseded FAISS index files for {company_id}")
+    finally:
+        _unlock_build(lock)
+    # Reopen so this process shares the mapped copy instead of keeping its own
+    try:
+        return load(key, embedding, record=False) or built
+    except OSError:
+        return built
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""Image normalization before multimodal quiz generation.
+
+Phone photos of slides are often several megabytes at 12 MP, far more than
+Gemini needs to read them. Each image is:
+    - rotated upright from its EXIF orientation, then downsampled so its
+      longest side is at most IMAGE_MAX_DIMENSION
+    - re-encoded to IMAGE_FORMAT (webp by default) without EXIF/ICC/text metadata
+    - kept as-is when re-encoding would not make it smaller
+
+Decoding, resizing and encoding release the GIL in Pillow, so batches are
+processed in a small thread pool. Pillow is optional: without it images are
+passed through unchanged.
+
+Environment variables:
+    IMAGE_PREPROCESS        - "true" (default) or "false" to send originals
+    IMAGE_MAX_DIMENSION     - longest side in pixels after resizing (default 1600)
+    IMAGE_FORMAT            - webp (default), jpeg or png
+    IMAGE_QUALITY           - webp/jpeg quality (default 80)
+    IMAGE_WORKERS           - images processed in parallel (default 2)
+"""
+
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from metrics import counter, stage_timer
+
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "true").strip().lower() in ("1", "true", "yes")
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp").strip().lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_WORKERS = max(1, int(os.getenv("IMAGE_WORKERS", "2")))
+
+FORMAT_MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+IMAGE_BYTES = counter("image_preprocess_bytes_total", "Image bytes before and after normalization", ("stage",))
+IMAGE_RESULTS = counter("image_preprocess_total", "Images by normalization outcome", ("result",))
+
+
+@dataclass
+class ProcessedImage:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    original_size: Optional[Tuple[int, int]] = None
+    size: Optional[Tuple[int, int]] = None
+    seconds: float = 0.0
+    result: str = "passthrough"  # normalized | kept_original | passthrough | failed
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+        return _pool
+
+
+def _load_pillow():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None, None
+    return Image, ImageOps
+
+
+def normalize_image(data: bytes, mime_type: str) -> ProcessedImage:
+    """Downsample, strip metadata and re-encode one image; never raises."""
+    start = time.perf_counter()
+    processed = ProcessedImage(data=data, mime_type=mime_type, original_bytes=len(data))
+    Image, ImageOps = _load_pillow() if IMAGE_PREPROCESS else (None, None)
+    if Image is None:
+        processed.seconds = time.perf_counter() - start
+        return processed
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            processed.original_size = img.size
+            if getattr(img, "is_animated", False):
+                # Frames would be lost by re-encoding; send animations untouched
+                processed.size = img.size
+                processed.seconds = time.perf_counter() - start
+                return processed
+
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+            target = IMAGE_FORMAT if IMAGE_FORMAT in FORMAT_MIME_TYPES else "webp"
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            if target == "jpeg" or not has_alpha:
+                img = img.convert("RGB")
+            elif img.mode != "RGBA":
+                img = img.convert("RGBA")
+
+            out = io.BytesIO()
+            options = {"optimize": True} if target == "png" else {"quality": IMAGE_QUALITY}
+            # A fresh save carries no EXIF, ICC profile or text chunks unless passed explicitly
+            img.save(out, format=target.upper(), **options)
+            processed.size = img.size
+    except Exception as e:
+        print(f"[WARN] Image normalization failed ({e}); sending the original")
+        processed.result = "failed"
+        processed.seconds = time.perf_counter() - start
+        return processed
+
+    encoded = out.getvalue()
+    if len(encoded) < len(data):
+        processed.data = encoded
+        processed.mime_type = FORMAT_MIME_TYPES[target]
+        processed.result = "normalized"
+    else:
+        processed.result = "kept_original"
+    processed.seconds = time.perf_counter() - start
+    return processed
+
+
+def normalize_images(images: Sequence[Tuple[bytes, str]]) -> List[ProcessedImage]:
+    """Normalize (data, mime_type) pairs in the worker pool, preserving order."""
+    with stage_timer("image_preprocess"):
+        if len(images) == 1:
+            results = [normalize_image(*images[0])]
+        else:
+            results = list(_get_pool().map(lambda item: normalize_image(*item), images))
+    for item in results:
+        IMAGE_BYTES.inc(item.original_bytes, stage="before")
+        IMAGE_BYTES.inc(len(item.data), stage="after")
+        IMAGE_RESULTS.inc(result=item.result)
+    return results
+
+
+def summarize(images: Sequence[ProcessedImage], elapsed: float) -> dict:
+    """Before/after sizes and wall-clock preprocessing time for an API response."""
+    return {
+        "count": len(images),
+        "bytes_before": sum(i.original_bytes for i in images),
+        "bytes_after": sum(len(i.data) for i in images),
+        "preprocess_ms": round(elapsed * 1000, 1),
+        "results": [i.result for i in images],
+    }
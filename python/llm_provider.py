@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+"""Pluggable LLM provider layer shared by quiz_service.py and chatbot_service.py.
+
+Providers hand out the objects the services already use, so the call sites
+stay the same:
+    - generative_model(name)   -> object with generate_content(contents) -> .text
+    - upload_file / get_file   -> large-file upload handles with a .state
+    - chat_model(name, temp)   -> object with invoke(prompt_value) -> AIMessage
+    - embeddings(name)         -> object with embed_documents / embed_query
+
+Select the provider with LLM_PROVIDER:
+    gemini (default) - Google Gemini via google-generativeai / langchain-google-genai
+    stub             - deterministic offline provider for load tests and benchmarks
+
+Stub settings:
+    STUB_LLM_LATENCY_MS        - fixed latency per generation call (default 200)
+    STUB_LLM_TOKENS_PER_SEC    - simulated output rate, 0 = instant (default 200)
+    STUB_LLM_RESPONSE          - canned output text, or a path to a file containing it
+    STUB_EMBEDDING_LATENCY_MS  - latency per embedding call (default 0)
+    STUB_EMBEDDING_DIM         - embedding dimension (default 256)
+    STUB_LLM_TAIL_FRACTION     - share of calls that are slow, to exercise hedging (default 0)
+    STUB_LLM_TAIL_MULTIPLIER   - latency multiplier for those slow calls (default 10)
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class GeminiProvider:
+    """Google Gemini. SDK modules are imported on first use."""
+
+    name = "gemini"
+    display_name = "Google Gemini"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._configured = False
+        self._lock = threading.Lock()
+
+    def _genai(self):
+        import google.generativeai as genai
+        with self._lock:
+            if not self._configured:
+                genai.configure(api_key=self.api_key)
+                self._configured = True
+        return genai
+
+    def generative_model(self, model_name: str):
+        return self._genai().GenerativeModel(model_name)
+
+    def upload_file(self, file_path: str, mime_type: str):
+        return self._genai().upload_file(file_path, mime_type=mime_type)
+
+    def get_file(self, name: str):
+        return self._genai().get_file(name)
+
+    def chat_model(self, model_name: str, temperature: float = 0.7):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # Retries are owned by the shared rate limiter, so the client makes a single attempt
+        return ChatGoogleGenerativeAI(
+            model=model_name, google_api_key=self.api_key, temperature=temperature, max_retries=1
+        )
+
+    def embeddings(self, model_name: str):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=model_name, google_api_key=self.api_key)
+
+
+# -------------------------------------------------
+# Stub provider
+# -------------------------------------------------
+class StubResponse:
+    """Mimics the parts of a Gemini GenerateContentResponse the services read."""
+
+    def __init__(self, text: str, prompt_tokens: int, output_tokens: int):
+        self.text = text
+        self.usage_metadata = {
+            "prompt_token_count": prompt_tokens,
+            "candidates_token_count": output_tokens,
+            "total_token_count": prompt_tokens + output_tokens,
+        }
+
+
+class StubFile:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "ACTIVE"
+
+
+class StubGenerativeModel:
+    def __init__(self, provider: "StubProvider", model_name: str):
+        self.provider = provider
+        self.model_name = model_name
+
+    def generate_content(self, contents):
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        prompt = "\n".join(p for p in parts if isinstance(p, str))
+        return self.provider.complete(prompt, extra_parts=len(parts) - 1)
+
+
+class StubChatModel:
+    """Stands in for ChatGoogleGenerativeAI in the chat chain (invoke only)."""
+
+    def __init__(self, provider: "StubProvider", model_name: str):
+        self.provider = provider
+        self.model_name = model_name
+
+    def invoke(self, prompt_value, config=None, **kwargs):
+        from langchain_core.messages import AIMessage
+        text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+        response = self.provider.complete(text)
+        prompt_tokens = response.usage_metadata["prompt_token_count"]
+        output_tokens = response.usage_metadata["candidates_token_count"]
+        return AIMessage(
+            content=response.text,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": prompt_tokens + output_tokens,
+            },
+        )
+
+
+class StubEmbeddings:
+    """Hashed bag-of-words vectors: deterministic, and texts sharing words score as similar."""
+
+    def __init__(self, dim: int, latency_s: float):
+        self.dim = dim
+        self.latency_s = latency_s
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            bucket = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:4], "little")
+            vector[bucket % self.dim] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return self._embed(text)
+
+
+class StubProvider:
+    """Offline provider with configurable latency, token rate and canned output."""
+
+    name = "stub"
+    display_name = "Local stub"
+
+    def __init__(
+        self,
+        latency_ms: float = 200,
+        tokens_per_sec: float = 200,
+        canned_response: Optional[str] = None,
+        embedding_latency_ms: float = 0,
+        embedding_dim: int = 256,
+        tail_fraction: float = 0.0,
+        tail_multiplier: float = 10.0,
+    ):
+        self.latency_s = latency_ms / 1000.0
+        self.tokens_per_sec = tokens_per_sec
+        self.canned_response = canned_response
+        self.embedding_latency_s = embedding_latency_ms / 1000.0
+        self.embedding_dim = embedding_dim
+        self.tail_fraction = tail_fraction
+        self.tail_multiplier = tail_multiplier
+        self._file_counter = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "StubProvider":
+        canned = os.getenv("STUB_LLM_RESPONSE")
+        if canned and Path(canned).is_file():
+            canned = Path(canned).read_text(encoding="utf-8")
+        return cls(
+            latency_ms=float(os.getenv("STUB_LLM_LATENCY_MS", "200")),
+            tokens_per_sec=float(os.getenv("STUB_LLM_TOKENS_PER_SEC", "200")),
+            canned_response=canned or None,
+            embedding_latency_ms=float(os.getenv("STUB_EMBEDDING_LATENCY_MS", "0")),
+            embedding_dim=int(os.getenv("STUB_EMBEDDING_DIM", "256")),
+            tail_fraction=float(os.getenv("STUB_LLM_TAIL_FRACTION", "0")),
+            tail_multiplier=float(os.getenv("STUB_LLM_TAIL_MULTIPLIER", "10")),
+        )
+
+    def _respond(self, prompt: str) -> str:
+        if self.canned_response is not None:
+            return self.canned_response
+        if '"questions"' in prompt:
+            match = re.search(r"create (\d+) multiple-choice", prompt)
+            # Question-bank top-ups list existing questions; number new ones after them
+            existing = prompt.count("\n- Stub question ")
+            return json.dumps(stub_quiz(int(match.group(1)) if match else 5, start=existing))
+        return "This is a stub answer generated without calling an LLM."
+
+    def complete(self, prompt: str, extra_parts: int = 0) -> StubResponse:
+        """Produce the response for a prompt, sleeping to simulate latency and token rate."""
+        text = self._respond(prompt)
+        prompt_tokens = max(1, len(prompt) // 4) + extra_parts * 258
+        output_tokens = max(1, len(text) // 4)
+        delay = self.latency_s
+        if self.tokens_per_sec > 0:
+            delay += output_tokens / self.tokens_per_sec
+        if self.tail_fraction and random.random() < self.tail_fraction:
+            delay *= self.tail_multiplier
+        if delay > 0:
+            time.sleep(delay)
+        return StubResponse(text, prompt_tokens, output_tokens)
+
+    def generative_model(self, model_name: str):
+        return StubGenerativeModel(self, model_name)
+
+    def upload_file(self, file_path: str, mime_type: str):
+        with self._lock:
+            self._file_counter += 1
+            return StubFile(f"files/stub-{self._file_counter}")
+
+    def get_file(self, name: str):
+        return StubFile(name)
+
+    def chat_model(self, model_name: str, temperature: float = 0.7):
+        return StubChatModel(self, model_name)
+
+    def embeddings(self, model_name: str):
+        return StubEmbeddings(self.embedding_dim, self.embedding_latency_s)
+
+
+def stub_quiz(num_questions: int, start: int = 0) -> Dict[str, Any]:
+    """Deterministic quiz payload in the format generate_quiz expects."""
+    return {
+        "questions": [
+            {
+                "question": f"Stub question {i + 1}?",
+                "options": [f"Option {letter}{i + 1}" for letter in "ABCD"],
+                "correctAnswer": i % 4,
+                "correctAnswerText": f"Option {'ABCD'[i % 4]}{i + 1}",
+            }
+            for i in range(start, start + num_questions)
+        ]
+    }
+
+
+# -------------------------------------------------
+# Process-wide provider
+# -------------------------------------------------
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def provider_name() -> str:
+    return os.getenv("LLM_PROVIDER", "gemini").strip().lower()
+
+
+def get_provider(api_key: Optional[str] = None):
+    """Return the configured provider, creating it on first use.
+
+    Passing an api_key (gemini only) replaces the current provider.
+    Raises ValueError when gemini is selected and no API key is available.
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is not None and api_key is None:
+            return _provider
+        name = provider_name()
+        if name == "stub":
+            _provider = StubProvider.from_env()
+        elif name == "gemini":
+            api_key = api_key or os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError(
+                    "Please set your Gemini API key:\n"
+                    "  1. Set environment variable: GEMINI_API_KEY=your_key_here\n"
+                    "  2. Or pass it to configure_gemini(api_key='your_key_here')\n"
+                    "  (or set LLM_PROVIDER=stub to run without Gemini)"
+                )
+            _provider = GeminiProvider(api_key)
+        else:
+            raise ValueError(f"Unknown LLM_PROVIDER '{name}'. Use 'gemini' or 'stub'.")
+        return _provider
+
+
+def set_provider(provider) -> None:
+    """Install a provider instance directly (e.g. a tuned StubProvider in benchmarks)."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+"""Client-side rate limiter and quota scheduler for Gemini calls.
+
+Shared by quiz_service.py and chatbot_service.py. Every Gemini call goes
+through RateLimitScheduler.call(), which:
+    - waits for both a requests-per-minute and a tokens-per-minute token bucket
+    - serves waiters strictly by priority, FIFO within a priority: in the quiz
+      service a single /ai request (someone is waiting for it) is INTERACTIVE,
+      /ai/batch and question bank generation are BACKGROUND; in the chatbot,
+      chat and query embeddings are INTERACTIVE, index builds BACKGROUND
+    - retries 429/5xx errors with full-jitter exponential backoff
+    - keeps queue depth / wait time counters for /health and /metrics
+
+Budgets are opt-in: every quota is unlimited unless configured, so an
+upgraded deployment is not throttled to a guessed tier. A configured budget
+is the service's total and is split evenly between its GEMINI_QUOTA_PROCESSES
+worker processes. Schedulers are per process: priority only orders callers
+within one worker, and the quiz and chat services do not share a scheduler.
+When both services use one API key, split the quota between them.
+
+Environment variables (0 or unset disables a budget):
+    GEMINI_RPM, GEMINI_TPM              - generate_content / chat budget (standard model)
+    GEMINI_LIGHT_RPM, GEMINI_LIGHT_TPM  - budget of the light model (see model_router.py)
+    GEMINI_EMBED_RPM, GEMINI_EMBED_TPM  - embedding budget
+    GEMINI_QUOTA_PROCESSES              - worker processes sharing the budgets
+                                          (default WEB_CONCURRENCY, else 1)
+    GEMINI_MAX_RETRIES                  - retries for 429/5xx (default 4)
+    GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_MAX - backoff bounds in seconds
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+import deadline
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Priorities: lower value is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of the current request; follows it into threadpool workers like the deadline
+_priority: ContextVar = ContextVar("llm_priority", default=None)
+
+
+@contextmanager
+def priority_scope(priority: int):
+    """Run calls inside the block at `priority` unless a caller passes one explicitly."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority(default: int = BACKGROUND) -> int:
+    """Priority set by the enclosing priority_scope(), or `default`."""
+    priority = _priority.get()
+    return default if priority is None else priority
+
+# Rough size of a non-text part (image / PDF) when estimating tokens
+FILE_PART_TOKENS = int(os.getenv("GEMINI_FILE_PART_TOKENS", "1000"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_MESSAGES = (
+    "429",
+    "resource exhausted",
+    "resource has been exhausted",
+    "rate limit",
+    "too many requests",
+    "quota",
+    "503",
+    "unavailable",
+    "500 internal",
+    "internal error",
+)
+
+
+def estimate_tokens(contents: Any) -> int:
+    """Cheap token estimate (~4 chars per token) for text, prompt values or multimodal part lists."""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    if hasattr(contents, "to_string"):  # LangChain PromptValue
+        return estimate_tokens(contents.to_string())
+    return FILE_PART_TOKENS
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """True for rate-limit (429) and transient server (5xx) errors."""
+    if isinstance(exc, deadline.DeadlineExceeded):
+        return False
+    for attr in ("code", "status_code"):
+        code = getattr(exc, attr, None)
+        if callable(code):
+            try:
+                code = code()
+            except Exception:
+                code = None
+        if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+            return True
+    message = str(exc).lower()
+    return any(marker in message for marker in RETRYABLE_MESSAGES)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute / 60` tokens per second.
+
+    A budget of 0 (or less) means unlimited. Not thread-safe on its own; the
+    scheduler holds its lock while using it.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # A single request larger than the whole budget waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        if not self.unlimited:
+            self.tokens -= min(amount, self.capacity)
+
+
+class RateLimitScheduler:
+    """Priority scheduler in front of one Gemini quota (RPM + TPM)."""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_retries: int = 4,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._waiters: list = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.waited_calls = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.wait_seconds_by_priority: Dict[str, float] = {n: 0.0 for n in PRIORITY_NAMES.values()}
+
+    def acquire(self, priority: int = BACKGROUND, tokens: int = 1) -> float:
+        """Block until this caller is first in line and both budgets allow it. Returns seconds waited.
+
+        Raises deadline.DeadlineExceeded instead of waiting past the request deadline.
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    if self._waiters[0] == ticket:
+                        now = time.monotonic()
+                        delay = max(self.requests.time_until(1, now), self.tokens.time_until(tokens, now))
+                        if delay <= 0:
+                            self.requests.consume(1)
+                            self.tokens.consume(tokens)
+                            break
+                        deadline.check(f"{self.name}_quota", needed=delay)
+                        self._cond.wait(delay)
+                    else:
+                        deadline.check(f"{self.name}_quota", needed=0)
+                        self._cond.wait(deadline.remaining())
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self.calls += 1
+            if waited > 0.001:
+                self.waited_calls += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            priority_name = PRIORITY_NAMES.get(priority, str(priority))
+            self.wait_seconds_by_priority[priority_name] = (
+                self.wait_seconds_by_priority.get(priority_name, 0.0) + waited
+            )
+        if waited > 1:
+            logger.info(f"⏳ [{self.name}] waited {waited:.1f}s for Gemini quota ({priority_name})")
+        return waited
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        """Take quota only if it is available right now and nobody is waiting (used for hedges)."""
+        with self._cond:
+            if self._waiters:
+                return False
+            now = time.monotonic()
+            if self.requests.time_until(1, now) > 0 or self.tokens.time_until(tokens, now) > 0:
+                return False
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.calls += 1
+            return True
+
+    def wait_estimate(self, tokens: int = 1) -> float:
+        """Rough seconds a new call would wait for quota right now, queued callers included. Takes nothing."""
+        with self._cond:
+            now = time.monotonic()
+            delay = max(self.requests.time_until(1, now), self.tokens.time_until(tokens, now))
+            if self._waiters and not self.requests.unlimited:
+                delay += len(self._waiters) / self.requests.rate
+            return delay
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def call(self, fn: Callable[[], T], priority: int = BACKGROUND, tokens: int = 1) -> T:
+        """Run `fn` once quota allows, retrying rate-limit and 5xx errors with backoff."""
+        attempt = 0
+        while True:
+            self.acquire(priority=priority, tokens=tokens)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    with self._cond:
+                        self.failures += 1
+                    raise
+                delay = self._backoff(attempt)
+                left = deadline.remaining()
+                if left is not None and delay >= left:
+                    # No time left for another attempt within the request budget
+                    with self._cond:
+                        self.failures += 1
+                    raise
+                attempt += 1
+                with self._cond:
+                    self.retries += 1
+                logger.warning(
+                    f"⚠️ [{self.name}] retryable Gemini error ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            depth_by_priority: Dict[str, int] = {n: 0 for n in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiters:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                depth_by_priority[name] = depth_by_priority.get(name, 0) + 1
+            return {
+                "requests_per_minute": self.requests.capacity,
+                "tokens_per_minute": self.tokens.capacity,
+                "queue_depth": len(self._waiters),
+                "queue_depth_by_priority": depth_by_priority,
+                "calls": self.calls,
+                "waited_calls": self.waited_calls,
+                "wait_seconds_total": round(self.wait_seconds_total, 3),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.calls, 3) if self.calls else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 3),
+                "wait_seconds_by_priority": {k: round(v, 3) for k, v in self.wait_seconds_by_priority.items()},
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+
+
+# -------------------------------------------------
+# Process-wide schedulers, one per Gemini quota
+# -------------------------------------------------
+_SCHEDULER_ENV = {
+    # name: (rpm env, tpm env)
+    "generate": ("GEMINI_RPM", "GEMINI_TPM"),
+    "generate_light": ("GEMINI_LIGHT_RPM", "GEMINI_LIGHT_TPM"),
+    "embed": ("GEMINI_EMBED_RPM", "GEMINI_EMBED_TPM"),
+}
+_schedulers: Dict[str, RateLimitScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name: str = "generate") -> RateLimitScheduler:
+    """Return the shared scheduler for a quota ("generate", "generate_light" or "embed"), creating it from env on first use."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(name)
+        if scheduler is None:
+            rpm_env, tpm_env = _SCHEDULER_ENV[name]
+            processes = max(1, int(os.getenv("GEMINI_QUOTA_PROCESSES") or os.getenv("WEB_CONCURRENCY") or "1"))
+            scheduler = RateLimitScheduler(
+                name,
+                requests_per_minute=float(os.getenv(rpm_env, "0")) / processes,
+                tokens_per_minute=float(os.getenv(tpm_env, "0")) / processes,
+                max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "4")),
+                backoff_base=float(os.getenv("GEMINI_BACKOFF_BASE", "1.0")),
+                backoff_max=float(os.getenv("GEMINI_BACKOFF_MAX", "30.0")),
+            )
+            _schedulers[name] = scheduler
+        return scheduler
+
+
+def scheduler_stats(names: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Stats for the named schedulers (default: every quota), keyed by quota name."""
+    return {name: get_scheduler(name).stats() for name in (names or list(_SCHEDULER_ENV))}
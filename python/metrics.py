@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""Prometheus-style metrics shared by quiz_service.py and chatbot_service.py.
+
+Dependency-free counters, gauges and histograms rendered in the Prometheus
+text exposition format. Recording is a dict lookup plus a short lock, so
+instrumenting hot paths is cheap.
+
+    with stage_timer("llm_call"):
+        ...
+
+    install(app)  # adds request metrics middleware and GET /metrics
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge set directly, or computed at scrape time from a callback.
+
+    The callback returns a number (no labels) or {label_values_tuple: number}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function: Optional[Callable] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable) -> None:
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            result = self._function()
+            items = list(result.items()) if isinstance(result, dict) else [((), result)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., +Inf count], sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # Re-registering (e.g. module reload) returns the existing metric
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = (), function: Optional[Callable] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, function))
+
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# -------------------------------------------------
+# Metrics common to both services
+# -------------------------------------------------
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests handled", ("method", "path", "status"))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency", ("method", "path"))
+HTTP_IN_FLIGHT = gauge("http_requests_in_flight", "HTTP requests currently being handled")
+STAGE_LATENCY = histogram("stage_duration_seconds", "Time spent per processing stage", ("stage",))
+STAGE_ERRORS = counter("stage_errors_total", "Processing stages that raised", ("stage",))
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups by result (hit/miss)", ("cache", "result"))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Record the duration of a block under stage_duration_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _scheduler_gauge(field: str):
+    def collect():
+        from llm_scheduler import scheduler_stats
+        return {(name,): stats[field] for name, stats in scheduler_stats().items()}
+    return collect
+
+
+def _scheduler_queue_depth():
+    from llm_scheduler import scheduler_stats
+    return {
+        (name, priority): depth
+        for name, stats in scheduler_stats().items()
+        for priority, depth in stats["queue_depth_by_priority"].items()
+    }
+
+
+gauge("llm_scheduler_queue_depth", "Callers waiting for Gemini quota", ("quota", "priority"), _scheduler_queue_depth)
+gauge("llm_scheduler_calls", "Calls admitted by the rate limiter", ("quota",), _scheduler_gauge("calls"))
+gauge("llm_scheduler_wait_seconds", "Cumulative time spent waiting for quota", ("quota",),
+      _scheduler_gauge("wait_seconds_total"))
+gauge("llm_scheduler_retries", "Retries of rate-limited or failed Gemini calls", ("quota",), _scheduler_gauge("retries"))
+
+
+# -------------------------------------------------
+# ASGI integration
+# -------------------------------------------------
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request counts, latency and in-flight requests.
+
+    Paths are labelled by the template of the matched route (e.g.
+    /bank/{bank_id}/quiz), which the router stores in the shared scope;
+    unmatched requests are "other" to keep label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope.get("method", "")
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path_format", None) or getattr(route, "path", None) or "other"
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=method, path=path)
+            HTTP_REQUESTS.inc(method=method, path=path, status=str(status["code"]))
+
+
+def install(app) -> None:
+    """Add the metrics middleware and a GET /metrics endpoint to a FastAPI app."""
+    from starlette.responses import Response
+
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
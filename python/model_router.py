@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""Cost- and latency-aware model choice for quiz and chat generation.
+
+Two model tiers are configured. Gemini rate limits are per model, so each
+tier has its own quota scheduler (see llm_scheduler.py):
+    standard  - GEMINI_MODEL (default gemini-2.0-flash), quota "generate"
+    light     - GEMINI_LIGHT_MODEL (default gemini-2.0-flash-lite), quota "generate_light"
+
+route() picks a tier per call:
+    - text quizzes go to light when the input is at most
+      ROUTER_LIGHT_MAX_INPUT_TOKENS and at most ROUTER_LIGHT_MAX_QUESTIONS
+      questions are requested; files and images go to standard
+    - chat prompts go to light when they are at most ROUTER_LIGHT_CHAT_MAX_TOKENS
+      (FAQ-style questions with little retrieved context and history)
+    - the call moves to the other tier when the preferred one would wait
+      ROUTER_OVERFLOW_WAIT_S longer for quota, or when its recent latency is
+      above ROUTER_LATENCY_SLO_MS and the other tier's is not
+
+Environment variables:
+    MODEL_ROUTING                  - "true" (default) or "false" to always use GEMINI_MODEL
+    GEMINI_MODEL                   - standard model (default gemini-2.0-flash)
+    GEMINI_LIGHT_MODEL             - light model (default gemini-2.0-flash-lite)
+    ROUTER_LIGHT_MAX_INPUT_TOKENS  - largest text quiz prompt for light (default 1500)
+    ROUTER_LIGHT_MAX_QUESTIONS     - most questions per quiz for light (default 10)
+    ROUTER_LIGHT_CHAT_MAX_TOKENS   - largest chat prompt for light (default 1500)
+    ROUTER_OVERFLOW_WAIT_S         - extra quota wait that moves a call to the other tier (default 5)
+    ROUTER_LATENCY_SLO_MS          - recent latency above which a tier is avoided (default 0 = off)
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from llm_scheduler import get_scheduler
+from metrics import counter, histogram
+
+STANDARD = "standard"
+LIGHT = "light"
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "true").strip().lower() in ("1", "true", "yes")
+STANDARD_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+LIGHT_MODEL = os.getenv("GEMINI_LIGHT_MODEL", "gemini-2.0-flash-lite")
+ROUTER_LIGHT_MAX_INPUT_TOKENS = int(os.getenv("ROUTER_LIGHT_MAX_INPUT_TOKENS", "1500"))
+ROUTER_LIGHT_MAX_QUESTIONS = int(os.getenv("ROUTER_LIGHT_MAX_QUESTIONS", "10"))
+ROUTER_LIGHT_CHAT_MAX_TOKENS = int(os.getenv("ROUTER_LIGHT_CHAT_MAX_TOKENS", "1500"))
+ROUTER_OVERFLOW_WAIT_S = float(os.getenv("ROUTER_OVERFLOW_WAIT_S", "5"))
+ROUTER_LATENCY_SLO_MS = float(os.getenv("ROUTER_LATENCY_SLO_MS", "0"))
+
+TIER_MODELS = {STANDARD: STANDARD_MODEL, LIGHT: LIGHT_MODEL}
+TIER_SCHEDULERS = {STANDARD: "generate", LIGHT: "generate_light"}
+
+ROUTING_DECISIONS = counter("llm_routing_decisions_total", "Model routing decisions", ("task", "model", "reason"))
+MODEL_LATENCY = histogram(
+    "llm_model_call_seconds", "Latency of individual LLM calls per model", ("task", "model"),
+    buckets=(0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0),
+)
+MODEL_TOKENS = counter("llm_model_tokens_total", "Tokens used per model", ("model", "kind"))
+
+
+@dataclass(frozen=True)
+class Route:
+    tier: str
+    model: str
+    scheduler: str
+    reason: str
+
+
+# Moving average of call latency per model and when it was last updated.
+# A tier avoided for being slow gets no new samples, so old averages expire
+# and the next call probes it again.
+LATENCY_MAX_AGE_S = 60.0
+_latency: Dict[str, Tuple[float, float]] = {}
+_decisions: Dict[Tuple[str, str], int] = {}
+_lock = threading.Lock()
+
+
+def _route(tier: str, reason: str) -> Route:
+    return Route(tier, TIER_MODELS[tier], TIER_SCHEDULERS[tier], reason)
+
+
+def _preferred(task: str, input_tokens: int, source_type: str, num_questions: int) -> Tuple[str, str]:
+    if task == "chat":
+        if input_tokens <= ROUTER_LIGHT_CHAT_MAX_TOKENS:
+            return LIGHT, "short_chat"
+        return STANDARD, "long_chat"
+    if source_type != "text":
+        return STANDARD, "multimodal"
+    if num_questions > ROUTER_LIGHT_MAX_QUESTIONS:
+        return STANDARD, "many_questions"
+    if input_tokens > ROUTER_LIGHT_MAX_INPUT_TOKENS:
+        return STANDARD, "long_input"
+    return LIGHT, "short_text"
+
+
+def _too_slow(tier: str) -> bool:
+    with _lock:
+        seconds, updated = _latency.get(TIER_MODELS[tier], (None, 0.0))
+    if seconds is None or time.monotonic() - updated > LATENCY_MAX_AGE_S:
+        return False
+    return seconds * 1000 > ROUTER_LATENCY_SLO_MS
+
+
+def route(task: str, input_tokens: int, source_type: str = "text", num_questions: int = 0,
+          budget_tokens: Optional[int] = None) -> Route:
+    """Pick the model for one call.
+
+    task is "quiz" or "chat"; source_type is "text" for prompts built from
+    text (including extracted PDF text and transcripts) and "file" / "image"
+    for multimodal parts. budget_tokens is what the call will take from the
+    quota (defaults to input_tokens).
+    """
+    if not MODEL_ROUTING or LIGHT_MODEL == STANDARD_MODEL:
+        choice = _route(STANDARD, "routing_off")
+    else:
+        tier, reason = _preferred(task, input_tokens, source_type, num_questions)
+        other = LIGHT if tier == STANDARD else STANDARD
+        tokens = budget_tokens or input_tokens
+        extra_wait = (get_scheduler(TIER_SCHEDULERS[tier]).wait_estimate(tokens)
+                      - get_scheduler(TIER_SCHEDULERS[other]).wait_estimate(tokens))
+        if extra_wait > ROUTER_OVERFLOW_WAIT_S:
+            tier, reason = other, f"{tier}_busy"
+        elif ROUTER_LATENCY_SLO_MS > 0 and _too_slow(tier) and not _too_slow(other):
+            tier, reason = other, f"{tier}_slow"
+        choice = _route(tier, reason)
+
+    ROUTING_DECISIONS.inc(task=task, model=choice.model, reason=choice.reason)
+    with _lock:
+        key = (task, choice.model)
+        _decisions[key] = _decisions.get(key, 0) + 1
+    return choice
+
+
+def _usage_tokens(response: Any) -> Tuple[Optional[int], Optional[int]]:
+    """(input, output) tokens reported by a Gemini response or LangChain message, if any."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None, None
+
+    def get(key):
+        return usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+
+    # google-generativeai reports *_token_count; LangChain messages use input/output_tokens
+    return (get("prompt_token_count") or get("input_tokens"),
+            get("candidates_token_count") or get("output_tokens"))
+
+
+def record_call(task: str, model: str, seconds: float, response: Any, input_tokens: int) -> None:
+    """Record latency and token usage of one call; token counts fall back to estimates."""
+    MODEL_LATENCY.observe(seconds, task=task, model=model)
+    with _lock:
+        previous, _ = _latency.get(model, (None, 0.0))
+        average = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+        _latency[model] = (average, time.monotonic())
+
+    reported_in, reported_out = _usage_tokens(response)
+    if reported_out is None:
+        try:
+            text = getattr(response, "text", None) or getattr(response, "content", None) or ""
+        except ValueError:  # Gemini raises on .text for blocked responses
+            text = ""
+        reported_out = len(str(text)) // 4
+    MODEL_TOKENS.inc(reported_in or input_tokens, model=model, kind="input")
+    MODEL_TOKENS.inc(reported_out, model=model, kind="output")
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "enabled": MODEL_ROUTING,
+            "models": dict(TIER_MODELS),
+            "decisions": {f"{task}:{model}": n for (task, model), n in sorted(_decisions.items())},
+            "latency_ms": {model: round(seconds * 1000, 1) for model, (seconds, _) in _latency.items()},
+        }
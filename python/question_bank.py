@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""Local question banks: a pool of validated questions per content item.
+
+A bank is generated once per content hash (see quiz_service.py) and stored
+as a JSON file under QUESTION_BANK_DIR, together with the source needed to
+top it up later. Quizzes of any size are then sampled from the pool without
+calling Gemini:
+    - questions are shuffled, and so are their options
+    - with a trainee id, questions already served to that trainee are not
+      repeated until the pool is exhausted
+    - the pool is reported as "low" when fewer than QUESTION_BANK_LOW_WATER
+      unseen questions remain for the trainee
+
+Environment variables:
+    QUESTION_BANK_DIR        - storage directory (default ./question_bank)
+    QUESTION_BANK_SIZE       - questions generated for a new bank (default 30)
+    QUESTION_BANK_LOW_WATER  - unseen questions below which the pool is low (default 10)
+"""
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import counter
+
+QUESTION_BANK_DIR = Path(os.getenv("QUESTION_BANK_DIR", str(Path(__file__).parent / "question_bank")))
+QUESTION_BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", "30"))
+QUESTION_BANK_LOW_WATER = int(os.getenv("QUESTION_BANK_LOW_WATER", "10"))
+
+BANK_QUIZZES = counter("question_bank_quizzes_total", "Quizzes served from question banks")
+BANK_QUESTIONS_ADDED = counter("question_bank_questions_added_total", "Generated questions added to banks",
+                               ("result",))
+
+
+class BankNotFound(KeyError):
+    pass
+
+
+class PoolExhausted(ValueError):
+    pass
+
+
+def question_id(question: dict) -> str:
+    """Stable id from the normalized question text, used for de-duplication."""
+    text = " ".join(str(question.get("question") or "").lower().split())
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def _shuffle_options(question: dict, rng: random.Random) -> dict:
+    options = list(question["options"])
+    correct_text = options[question["correctAnswer"]]
+    order = list(range(len(options)))
+    rng.shuffle(order)
+    shuffled = [options[i] for i in order]
+    correct = order.index(question["correctAnswer"])
+    return {
+        "id": question["id"],
+        "question": question["question"],
+        "options": shuffled,
+        "correctAnswer": correct,
+        "correctAnswerText": correct_text,
+    }
+
+
+class QuestionBankStore:
+    """JSON-file storage for banks; one lock per bank serializes read-modify-write."""
+
+    def __init__(self, directory: Path = QUESTION_BANK_DIR):
+        self.directory = Path(directory)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, bank_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(bank_id, threading.Lock())
+
+    def _path(self, bank_id: str) -> Path:
+        if not bank_id or not all(c in "0123456789abcdef" for c in bank_id):
+            raise BankNotFound(bank_id)
+        return self.directory / f"{bank_id}.json"
+
+    def source_path(self, bank_id: str) -> Path:
+        """Where a file source (PDF/image bytes) is kept for top-ups."""
+        return self.directory / f"{bank_id}.source"
+
+    def _read(self, bank_id: str) -> dict:
+        path = self._path(bank_id)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BankNotFound(bank_id)
+
+    def _write(self, bank: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write then rename so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(bank, f, ensure_ascii=False)
+        os.replace(tmp, self._path(bank["bank_id"]))
+
+    def exists(self, bank_id: str) -> bool:
+        try:
+            return self._path(bank_id).exists()
+        except BankNotFound:
+            return False
+
+    def get(self, bank_id: str) -> dict:
+        with self._lock(bank_id):
+            return self._read(bank_id)
+
+    def create(self, bank_id: str, source: dict, source_bytes: Optional[bytes] = None) -> dict:
+        """Create an empty bank (no-op when it exists) and return it."""
+        with self._lock(bank_id):
+            try:
+                return self._read(bank_id)
+            except BankNotFound:
+                pass
+            if source_bytes is not None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self.source_path(bank_id).write_bytes(source_bytes)
+            bank = {
+                "bank_id": bank_id,
+                "source": source,
+                "created_at": time.time(),
+                "updated_at": time.time(),
+                "questions": [],
+                "served": {},
+            }
+            self._write(bank)
+            return bank
+
+    def add_questions(self, bank_id: str, questions: List[dict]) -> int:
+        """Append validated questions, skipping duplicates and incomplete ones. Returns the number added."""
+        with self._lock(bank_id):
+            bank = self._read(bank_id)
+            known = {q["id"] for q in bank["questions"]}
+            added = 0
+            for q in questions:
+                options = q.get("options") or []
+                if not q.get("question") or len(options) != 4 or any(not str(o).strip() for o in options):
+                    BANK_QUESTIONS_ADDED.inc(result="invalid")
+                    continue
+                qid = question_id(q)
+                if qid in known:
+                    BANK_QUESTIONS_ADDED.inc(result="duplicate")
+                    continue
+                known.add(qid)
+                bank["questions"].append({
+                    "id": qid,
+                    "question": q["question"],
+                    "options": options,
+                    "correctAnswer": q["correctAnswer"],
+                })
+                added += 1
+            BANK_QUESTIONS_ADDED.inc(added, result="added")
+            bank["updated_at"] = time.time()
+            self._write(bank)
+            return added
+
+    def sample(self, bank_id: str, num_questions: int, trainee_id: Optional[str] = None) -> dict:
+        """Randomized quiz from the pool; per trainee, never repeats served questions."""
+        with self._lock(bank_id):
+            bank = self._read(bank_id)
+            served = set(bank["served"].get(trainee_id, [])) if trainee_id else set()
+            unseen = [q for q in bank["questions"] if q["id"] not in served]
+            if len(unseen) < num_questions:
+                raise PoolExhausted(
+                    f"Question bank has {len(unseen)} unused questions for this trainee; "
+                    f"{num_questions} requested. Top up the bank and try again."
+                )
+            rng = random.Random()
+            picked = rng.sample(unseen, num_questions)
+            if trainee_id:
+                bank["served"][trainee_id] = sorted(served | {q["id"] for q in picked})
+                self._write(bank)
+        BANK_QUIZZES.inc()
+        remaining = len(unseen) - num_questions
+        return {
+            "questions": [_shuffle_options(q, rng) for q in picked],
+            "bank": {
+                "bankId": bank_id,
+                "poolSize": len(bank["questions"]),
+                "remaining": remaining,
+                "low": remaining < QUESTION_BANK_LOW_WATER,
+            },
+        }
+
+    def stats(self, bank_id: str) -> dict:
+        bank = self.get(bank_id)
+        return {
+            "bankId": bank_id,
+            "source": {k: v for k, v in bank["source"].items() if k != "text"},
+            "poolSize": len(bank["questions"]),
+            "trainees": len(bank["served"]),
+            "createdAt": bank["created_at"],
+            "updatedAt": bank["updated_at"],
+        }
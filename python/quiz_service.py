@@ -9,39 +9,55 @@ Dependencies (install with: pip install google-generativeai pdfplumber yt-dlp):
     - google-generativeai: For Gemini AI integration
     - pdfplumber: For PDF text extraction
     - yt-dlp: For YouTube transcript extraction (more reliable than youtube-transcript-api)
-    - Pillow: For image processing (optional)
+    - Pillow: For image pre-processing before upload (optional, see image_pipeline.py)
 
 yt-dlp is preferred over youtube-transcript-api because:
     ✅ Actively maintained and updated for YouTube changes
     ✅ More robust error handling
     ✅ Better support for various video types
-"""
 
-try:
-    import google.generativeai as genai
-    import pdfplumber
-    import yt_dlp
-except ImportError as e:
-    print(f"[ERROR] Missing dependency: {e}")
-    print("Please install required packages: pip install google-generativeai pdfplumber yt-dlp")
-    raise
+Heavy dependencies (pdfplumber, yt-dlp, the Gemini SDK) are imported on first
+use per source type, and the model client is created in the app's startup
+hook, so the service starts quickly. Track import cost with
+benchmarks/bench_startup.py.
+"""
 
 import json
 import re
 import os
 import sys
+import asyncio
 import argparse
+import hashlib
+import importlib
 import tempfile
+import threading
+import time
 import urllib.request
 import urllib.parse
 import mimetypes
-from typing import Optional, Union
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Union
 from pathlib import Path
 
+from llm_provider import get_provider, provider_name
+from llm_scheduler import (INTERACTIVE, current_priority, estimate_tokens, get_scheduler, priority_scope,
+                           scheduler_stats)
+import deadline
+import image_pipeline
+import metrics
+import model_router
+from metrics import record_cache, stage_timer
+from question_bank import QUESTION_BANK_SIZE, BankNotFound, PoolExhausted, QuestionBankStore
+from deadline import DeadlineExceeded, hedged_call
+from single_flight import SingleFlight
+
 try:
     from fastapi import FastAPI, UploadFile, File, Form, Request
     from fastapi.middleware.cors import CORSMiddleware
-    from fastapi.responses import JSONResponse
+    from fastapi.responses import JSONResponse, StreamingResponse
+    from starlette.concurrency import run_in_threadpool
     import uvicorn
 except ImportError:
     # Server mode is optional; only needed when --serve is used
@@ -52,6 +68,8 @@ except ImportError:
     Request = None  # type: ignore
     CORSMiddleware = None  # type: ignore
     JSONResponse = None  # type: ignore
+    StreamingResponse = None  # type: ignore
+    run_in_threadpool = None  # type: ignore
     uvicorn = None  # type: ignore
 
 # --- LOAD .env FILE ---
@@ -75,53 +93,353 @@ except ImportError:
     print("[WARN] Will use environment variables only.")
 
 # --- CONFIGURE GEMINI ---
+# Standard model; short text quizzes may be routed to a lighter one (see model_router.py)
+QUIZ_MODEL_NAME = model_router.STANDARD_MODEL
+
 def configure_gemini(api_key=None):
-    """Configure Gemini API. Uses environment variable GEMINI_API_KEY if api_key is None."""
-    if api_key is None:
-        api_key = os.getenv("GEMINI_API_KEY")
-    
-    if not api_key:
-        raise ValueError(
-            "Please set your Gemini API key:\n"
-            "  1. Set environment variable: GEMINI_API_KEY=your_key_here\n"
-            "  2. Or pass it to configure_gemini(api_key='your_key_here')"
-        )
-    
-    genai.configure(api_key=api_key)
-    # Using gemini-2.0-flash model
-    return genai.GenerativeModel("gemini-2.0-flash")
+    """Configure the LLM provider and return the quiz model.
 
-# Initialize model (will raise error if API key not set)
-# ⭐ IMPORTANT: Set GEMINI_API_KEY in .env file or as environment variable
-try:
-    model = configure_gemini()
-    print("[OK] Gemini API configured successfully")
-except ValueError as e:
-    print(f"[ERROR] {e}")
-    print("[ERROR] Cannot start service without valid API key!")
-    print("[INFO] Make sure GEMINI_API_KEY is set in your .env file or as an environment variable.")
-    model = None
-
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF file."""
+    Uses environment variable GEMINI_API_KEY if api_key is None. With
+    LLM_PROVIDER=stub no key is needed and a local stub model is returned.
+    """
+    return get_provider(api_key=api_key).generative_model(QUIZ_MODEL_NAME)
+
+# Model client, created by init_model() in the app startup hook (or on first use)
+model = None
+_model_lock = threading.Lock()
+
+def init_model():
+    """Create the quiz model once. Returns None (after logging why) if no API key is set."""
+    global model
+    with _model_lock:
+        if model is not None:
+            return model
+        # ⭐ IMPORTANT: Set GEMINI_API_KEY in .env file or as environment variable
+        try:
+            model = configure_gemini()
+            if provider_name() == "stub":
+                print("[OK] Using local stub LLM provider (no Gemini calls)")
+            else:
+                print("[OK] Gemini API configured successfully")
+        except ValueError as e:
+            print(f"[ERROR] {e}")
+            print("[ERROR] Cannot start service without valid API key!")
+            print("[INFO] Make sure GEMINI_API_KEY is set in your .env file or as an environment variable.")
+        return model
+
+# Clients for routed models other than the default one, by model name
+_routed_models = {}
+
+def _model_for(model_name: str):
+    if model_name == QUIZ_MODEL_NAME and model is not None:
+        return model
+    with _model_lock:
+        if model_name not in _routed_models:
+            _routed_models[model_name] = get_provider().generative_model(model_name)
+        return _routed_models[model_name]
+
+def _lazy_import(module_name: str):
+    """Import a heavy dependency on first use, with an install hint if it is missing."""
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        print(f"[ERROR] Missing dependency: {e}")
+        raise ImportError(
+            f"Missing dependency: {e}. Please install required packages: "
+            "pip install google-generativeai pdfplumber yt-dlp"
+        ) from e
+
+# --- BATCH / SOURCE CACHE SETTINGS ---
+QUIZ_BATCH_CONCURRENCY = int(os.getenv("QUIZ_BATCH_CONCURRENCY", "4"))
+QUIZ_BATCH_MAX_SOURCES = int(os.getenv("QUIZ_BATCH_MAX_SOURCES", "50"))
+QUIZ_SOURCE_CACHE_SIZE = int(os.getenv("QUIZ_SOURCE_CACHE_SIZE", "128"))
+
+# Extracted text keyed by ("pdf", sha256) or ("youtube", video_id), and PDF
+# classifications keyed by ("pdf_class", sha256). Shared by /ai and /ai/batch
+# so repeated sources skip extraction entirely.
+_source_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+_source_cache_lock = threading.Lock()
+
+def _cache_get(key: tuple) -> Optional[Any]:
+    with _source_cache_lock:
+        value = _source_cache.get(key)
+        if value is not None:
+            _source_cache.move_to_end(key)
+    record_cache(f"source_{key[0]}", value is not None)
+    return value
+
+def _cache_put(key: tuple, value: Any) -> None:
+    if QUIZ_SOURCE_CACHE_SIZE <= 0:
+        return
+    with _source_cache_lock:
+        _source_cache[key] = value
+        _source_cache.move_to_end(key)
+        while len(_source_cache) > QUIZ_SOURCE_CACHE_SIZE:
+            _source_cache.popitem(last=False)
+
+def _file_digest(file_path: str) -> str:
+    """SHA-256 of a file's contents, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def extract_text_from_pdf(file_path, digest: Optional[str] = None, page_texts: Optional[Dict[int, str]] = None):
+    """Extract text from PDF file.
+
+    digest is the file's SHA-256 when already known; page_texts holds text
+    already extracted from some pages (by index), e.g. while classifying.
+    """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"PDF file not found: {file_path}")
     
+    cache_key = ("pdf", digest or _file_digest(file_path))
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        print(f"[OK] Using cached PDF text ({len(cached)} chars)")
+        return cached
+    
     text = ""
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
+        pdfplumber = _lazy_import("pdfplumber")
+        with stage_timer("pdf_extraction"), pdfplumber.open(file_path) as pdf:
+            for index, page in enumerate(pdf.pages):
+                if page_texts and index in page_texts:
+                    text += page_texts[index]
+                else:
+                    text += page.extract_text() or ""
         
         if not text.strip():
             raise ValueError(f"No text could be extracted from PDF: {file_path}")
         
         print(f"[OK] Extracted text from PDF ({len(text)} chars)")
+        _cache_put(cache_key, text)
         return text
     except Exception as e:
         raise ValueError(f"Failed to extract text from PDF: {e}")
 
+# --- PDF ROUTING (digital vs. scanned) ---
+# auto: classify locally; text: always extract text; multimodal: always upload the PDF
+PDF_ROUTING = os.getenv("PDF_ROUTING", "auto").strip().lower()
+PDF_SAMPLE_PAGES = int(os.getenv("PDF_SAMPLE_PAGES", "5"))
+PDF_MIN_CHARS_PER_PAGE = int(os.getenv("PDF_MIN_CHARS_PER_PAGE", "200"))
+PDF_SCANNED_MIN_IMAGE_COVERAGE = float(os.getenv("PDF_SCANNED_MIN_IMAGE_COVERAGE", "0.5"))
+PDF_UPLOAD_SCANNED_PAGES_ONLY = os.getenv("PDF_UPLOAD_SCANNED_PAGES_ONLY", "true").strip().lower() in ("1", "true", "yes")
+
+PDF_ROUTES = metrics.counter("pdf_routes_total", "PDFs by chosen generation route", ("route",))
+
+def _classify_page(page, text: Optional[str] = None) -> tuple:
+    """Return (is_digital, text) for a pdfplumber page; text is reused when already extracted.
+
+    Only pages with little text and mostly covered by images count as scanned;
+    short pages without images (covers, dividers, blank pages) stay digital.
+    """
+    if text is None:
+        text = page.extract_text() or ""
+    if len(text.strip()) >= PDF_MIN_CHARS_PER_PAGE:
+        return True, text
+    page_area = float(page.width * page.height) or 1.0
+    image_area = sum(abs((img["x1"] - img["x0"]) * (img["bottom"] - img["top"])) for img in page.images)
+    coverage = min(1.0, image_area / page_area)
+    return coverage < PDF_SCANNED_MIN_IMAGE_COVERAGE, text
+
+def classify_pdf(file_path: str, sample_pages: Optional[int] = None,
+                 page_texts: Optional[Dict[int, str]] = None) -> dict:
+    """Sample a few evenly spaced pages and classify the PDF as digital, scanned or mixed.
+
+    The text of the sampled pages is stored in page_texts (by page index) when
+    given, so extraction does not have to read those pages again.
+
+    A page counts as scanned when it has little text (under PDF_MIN_CHARS_PER_PAGE)
+    and images cover at least PDF_SCANNED_MIN_IMAGE_COVERAGE of it.
+    """
+    sample_pages = sample_pages or PDF_SAMPLE_PAGES
+    pdfplumber = _lazy_import("pdfplumber")
+    with stage_timer("pdf_classify"), pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+        if page_count <= sample_pages:
+            indices = list(range(page_count))
+        else:
+            step = (page_count - 1) / (sample_pages - 1) if sample_pages > 1 else 0
+            indices = sorted({round(i * step) for i in range(sample_pages)})
+        digital = 0
+        for i in indices:
+            is_digital, text = _classify_page(pdf.pages[i])
+            digital += is_digital
+            if page_texts is not None:
+                page_texts[i] = text
+    if digital == len(indices):
+        kind = "digital"
+    elif digital == 0:
+        kind = "scanned"
+    else:
+        kind = "mixed"
+    return {"kind": kind, "page_count": page_count, "sampled_pages": len(indices), "digital_sampled": digital}
+
+def _write_pdf_pages(file_path: str, page_indices: list) -> str:
+    """Copy the given pages into a new temporary PDF and return its path."""
+    pdfium = _lazy_import("pypdfium2")  # installed with pdfplumber
+    source = pdfium.PdfDocument(file_path)
+    subset = pdfium.PdfDocument.new()
+    try:
+        subset.import_pages(source, page_indices)
+        fd, subset_path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        subset.save(subset_path)
+        return subset_path
+    finally:
+        subset.close()
+        source.close()
+
+def generate_quiz_from_pdf(file_path: str, num_questions: int = 5, model_instance=None,
+                           avoid_questions: Optional[List[str]] = None) -> dict:
+    """Route a PDF to the cheapest path that preserves its content.
+
+    Digital PDFs are sent as compact extracted text; scanned PDFs go through
+    Gemini multimodal; mixed PDFs send the text of digital pages plus only the
+    scanned pages as a smaller PDF. The chosen route is added to the result.
+    """
+    file_size = os.path.getsize(file_path)
+    route = {"type": "multimodal", "reason": "PDF_ROUTING=multimodal", "file_bytes": file_size}
+    
+    if PDF_ROUTING != "multimodal":
+        digest = _file_digest(file_path)
+        page_texts: Dict[int, str] = {}
+        info = _cache_get(("pdf_class", digest))
+        if info is None:
+            try:
+                info = classify_pdf(file_path, page_texts=page_texts)
+                _cache_put(("pdf_class", digest), info)
+            except Exception as e:
+                print(f"[WARN] PDF classification failed ({e}); using multimodal upload")
+                info = {"kind": "unknown"}
+        route.update(info, reason=f"classified as {info['kind']}")
+        print(f"[INFO] PDF route decision: {info}")
+        
+        if info["kind"] == "digital" or (PDF_ROUTING == "text" and info["kind"] != "unknown"):
+            try:
+                text = extract_text_from_pdf(file_path, digest=digest, page_texts=page_texts)
+            except ValueError as e:
+                # e.g. sampled pages had text but extraction came back empty
+                print(f"[WARN] Text extraction failed ({e}); using multimodal upload")
+                route["reason"] = f"text extraction failed: {e}"
+            else:
+                # Generation errors propagate as on the text route; re-running the
+                # request multimodally would only add Gemini calls
+                result = generate_quiz(text, num_questions=num_questions, model_instance=model_instance,
+                                       avoid_questions=avoid_questions)
+                route.update(type="text", bytes_sent=len(text[:8000].encode("utf-8")))
+                PDF_ROUTES.inc(route="text")
+                result["route"] = route
+                return result
+        
+        elif info["kind"] == "mixed" and PDF_UPLOAD_SCANNED_PAGES_ONLY:
+            result = _generate_quiz_from_mixed_pdf(file_path, num_questions, model_instance, route, avoid_questions,
+                                                   page_texts)
+            if result is not None:
+                return result
+    
+    result = generate_quiz_from_file(file_path, num_questions=num_questions, mime_type="application/pdf",
+                                     model_instance=model_instance, avoid_questions=avoid_questions)
+    route.update(type="multimodal", bytes_sent=file_size)
+    PDF_ROUTES.inc(route="multimodal")
+    result["route"] = route
+    return result
+
+def _generate_quiz_from_mixed_pdf(file_path: str, num_questions: int, model_instance, route: dict,
+                                  avoid_questions: Optional[List[str]] = None,
+                                  page_texts: Optional[Dict[int, str]] = None) -> Optional[dict]:
+    """Send digital pages as text and attach only the scanned pages. Returns None to fall back."""
+    pdfplumber = _lazy_import("pdfplumber")
+    texts, scanned = [], []
+    with stage_timer("pdf_extraction"), pdfplumber.open(file_path) as pdf:
+        for index, page in enumerate(pdf.pages):
+            is_digital, text = _classify_page(page, (page_texts or {}).get(index))
+            if is_digital:
+                texts.append(text)
+            else:
+                scanned.append(index)
+    
+    try:
+        subset_path = _write_pdf_pages(file_path, scanned)
+    except Exception as e:
+        print(f"[WARN] Could not split scanned pages ({e}); uploading the whole PDF")
+        return None
+    
+    try:
+        context_text = "\n".join(texts)
+        subset_bytes = os.path.getsize(subset_path)
+        print(f"[INFO] Mixed PDF: {len(texts)} text pages, uploading {len(scanned)} scanned pages ({subset_bytes} bytes)")
+        result = generate_quiz_from_file(subset_path, num_questions=num_questions, mime_type="application/pdf",
+                                         model_instance=model_instance, context_text=context_text,
+                                         avoid_questions=avoid_questions)
+    finally:
+        try:
+            os.remove(subset_path)
+        except OSError:
+            pass
+    
+    route.update(
+        type="mixed",
+        text_pages=len(texts),
+        scanned_pages=[i + 1 for i in scanned],
+        bytes_sent=subset_bytes + len(context_text[:8000].encode("utf-8")),
+    )
+    PDF_ROUTES.inc(route="mixed")
+    result["route"] = route
+    return result
+
 # --- GEMINI QUIZ GENERATOR ---
+# Output allowance per question when budgeting tokens-per-minute
+TOKENS_PER_QUESTION = 150
+
+def _generate_content(model_instance, contents, num_questions: int, source_type: str = "text"):
+    """Call model_instance.generate_content through the shared Gemini rate limiter.
+
+    The default model is routed per call: short text quizzes may go to the
+    light model (see model_router.py); an explicitly passed model is used
+    as-is. Calls wait for quota at the request's priority: single /ai
+    requests are interactive and served before /ai/batch and question bank
+    generation, which run at background priority. Unusually slow
+    calls are hedged with a duplicate request when quota allows (see deadline.py).
+    """
+    input_tokens = estimate_tokens(contents)
+    tokens = input_tokens + num_questions * TOKENS_PER_QUESTION
+    model_name, quota = QUIZ_MODEL_NAME, "generate"
+    if model_instance is model:
+        route = model_router.route("quiz", input_tokens, source_type, num_questions, budget_tokens=tokens)
+        model_instance, model_name, quota = _model_for(route.model), route.model, route.scheduler
+    scheduler = get_scheduler(quota)
+
+    def call():
+        start = time.perf_counter()
+        with stage_timer("llm_call"):
+            response = model_instance.generate_content(contents)
+        model_router.record_call("quiz", model_name, time.perf_counter() - start, response, input_tokens)
+        return response
+
+    hedge_name = "quiz_generate" if quota == "generate" else f"quiz_{quota}"
+    return scheduler.call(
+        lambda: hedged_call(hedge_name, call, lambda: scheduler.try_acquire(tokens)),
+        priority=current_priority(),
+        tokens=tokens,
+    )
+
+def _parse_quiz_response(text_output: str) -> dict:
+    """Extract the JSON quiz from a model response and repair it."""
+    with stage_timer("json_parse"):
+        # Try to extract valid JSON
+        match = re.search(r"\{[\s\S]*\}", text_output)
+        if match:
+            data = json.loads(match.group(0))
+        else:
+            raise ValueError(f"No valid JSON found in Gemini response. Response: {text_output[:200]}")
+        if 'questions' not in data:
+            raise ValueError("Response does not contain 'questions' key")
+        
+        return _validate_and_repair_quiz(data)
+
 def _validate_and_repair_quiz(data: dict) -> dict:
     repaired_questions = []
     for q in data.get("questions", []):
@@ -157,21 +475,17 @@ def _validate_and_repair_quiz(data: dict) -> dict:
         })
     return {"questions": repaired_questions}
 
-def generate_quiz(text, num_questions=5, model_instance=None):
-    """Generate MCQs using Gemini."""
-    # Validate num_questions
-    if not isinstance(num_questions, int) or num_questions < 1 or num_questions > 20:
-        raise ValueError("num_questions must be an integer between 1 and 20")
-    
-    if model_instance is None:
-        model_instance = model
-    
-    if model_instance is None:
-        raise ValueError("Gemini model not configured. Please set your API key first.")
-    
-    if not text or not text.strip():
-        raise ValueError("Text content is empty. Cannot generate quiz.")
-    
+def _avoid_questions_block(avoid_questions: Optional[List[str]]) -> str:
+    """Prompt suffix used when topping up a question bank: ask for new questions only."""
+    if not avoid_questions:
+        return ""
+    existing = "\n".join(f"- {q}" for q in avoid_questions[-100:])
+    return f"""
+Do NOT repeat or rephrase any of these existing questions:
+{existing}
+"""
+
+def _build_text_prompt(text: str, num_questions: int, avoid_questions: Optional[List[str]] = None) -> str:
     prompt = f"""
 You are a quiz generator AI.
 Read the following content and create {num_questions} multiple-choice questions
@@ -197,32 +511,47 @@ FORMAT (JSON ONLY, NO TEXT OUTSIDE JSON):
   ]
 }}
     """
+    return prompt + _avoid_questions_block(avoid_questions)
+
+def generate_quiz(text, num_questions=5, model_instance=None, avoid_questions: Optional[List[str]] = None):
+    """Generate MCQs using Gemini."""
+    # Validate num_questions
+    if not isinstance(num_questions, int) or num_questions < 1 or num_questions > 20:
+        raise ValueError("num_questions must be an integer between 1 and 20")
+    
+    if model_instance is None:
+        model_instance = model if model is not None else init_model()
+    
+    if model_instance is None:
+        raise ValueError("Gemini model not configured. Please set your API key first.")
+    
+    if not text or not text.strip():
+        raise ValueError("Text content is empty. Cannot generate quiz.")
+    
+    with stage_timer("prompt_assembly"):
+        prompt = _build_text_prompt(text, num_questions, avoid_questions)
     
     try:
-        response = model_instance.generate_content(prompt)
-        text_output = response.text
-        # Try to extract valid JSON
-        match = re.search(r"\{[\s\S]*\}", text_output)
-        if match:
-            data = json.loads(match.group(0))
-        else:
-            raise ValueError(f"No valid JSON found in Gemini response. Response: {text_output[:200]}")
-        if 'questions' not in data:
-            raise ValueError("Response does not contain 'questions' key")
-        
-        repaired = _validate_and_repair_quiz(data)
+        response = _generate_content(model_instance, prompt, num_questions)
+        repaired = _parse_quiz_response(response.text)
         print(f"[OK] Generated {len(repaired['questions'])} questions")
         return repaired
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise ValueError(f"Failed to generate quiz: {e}")
 
 # --- MULTIMODAL (FILES) WITH GEMINI ---
 def _wait_for_file_active(file_obj, timeout_seconds: int = 300):
-    import time
+    """Poll an uploaded file until it is ACTIVE, within the request deadline."""
+    left = deadline.remaining()
+    if left is not None:
+        timeout_seconds = min(timeout_seconds, left)
     start = time.time()
     last_state = None
     while True:
-        file_obj = genai.get_file(file_obj.name)
+        deadline.check("upload_wait")
+        file_obj = get_provider().get_file(file_obj.name)
         state = getattr(file_obj, "state", None)
         if state != last_state:
             print(f"[INFO] File state: {state}")
@@ -232,26 +561,17 @@ def _wait_for_file_active(file_obj, timeout_seconds: int = 300):
         if state == "FAILED":
             raise ValueError("File processing failed on server")
         if (time.time() - start) > timeout_seconds:
+            deadline.check("upload_wait")
             raise ValueError("File processing timed out")
-        time.sleep(2)
+        time.sleep(min(2, max(0, timeout_seconds - (time.time() - start))))
 
-def generate_quiz_from_file(file_path: str, num_questions: int = 5, mime_type: Optional[str] = None, model_instance=None):
-    if model_instance is None:
-        model_instance = model
-    if model_instance is None:
-        raise ValueError("Gemini model not configured. Please set your API key first.")
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-    if mime_type is None:
-        guessed, _ = mimetypes.guess_type(file_path)
-        mime_type = guessed or "application/octet-stream"
+INLINE_UPLOAD_LIMIT_BYTES = 8 * 1024 * 1024
 
-    try:
-        # Prefer fast inline path for small files (avoids slower upload processing)
-        file_size_bytes = os.path.getsize(file_path)
-        prompt = f"""
+def _build_file_prompt(num_questions: int, subject: str = "the attached file",
+                       avoid_questions: Optional[List[str]] = None) -> str:
+    prompt = f"""
 You are a quiz generator AI.
-Analyze the attached file and create {num_questions} multiple-choice questions
+Analyze {subject} and create {num_questions} multiple-choice questions
 that test understanding of the main ideas.
 
 FORMAT (JSON ONLY, NO TEXT OUTSIDE JSON):
@@ -266,41 +586,139 @@ FORMAT (JSON ONLY, NO TEXT OUTSIDE JSON):
   ]
 }}
 """
-        if file_size_bytes <= 8 * 1024 * 1024:  # <= 8 MB
+    return prompt + _avoid_questions_block(avoid_questions)
+
+def generate_quiz_from_file(file_path: str, num_questions: int = 5, mime_type: Optional[str] = None, model_instance=None,
+                            context_text: Optional[str] = None, avoid_questions: Optional[List[str]] = None):
+    """Generate a quiz from a file via Gemini multimodal.
+
+    context_text carries text already extracted locally from other parts of the
+    same document (e.g. digital pages when only scanned pages are attached).
+    """
+    if model_instance is None:
+        model_instance = model if model is not None else init_model()
+    if model_instance is None:
+        raise ValueError("Gemini model not configured. Please set your API key first.")
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+    if mime_type is None:
+        guessed, _ = mimetypes.guess_type(file_path)
+        mime_type = guessed or "application/octet-stream"
+
+    try:
+        # Prefer fast inline path for small files (avoids slower upload processing)
+        file_size_bytes = os.path.getsize(file_path)
+        prompt = _build_file_prompt(num_questions, avoid_questions=avoid_questions)
+        if context_text:
+            prompt += f"""
+The attached file contains only some pages of the document. Text extracted from the
+remaining pages (use it together with the attachment):
+{context_text[:8000]}
+"""
+        if file_size_bytes <= INLINE_UPLOAD_LIMIT_BYTES:
             print(f"[INFO] Using inline upload (fast path), size={file_size_bytes} bytes")
             with open(file_path, "rb") as f:
                 data_bytes = f.read()
             part = {"mime_type": mime_type, "data": data_bytes}
-            response = model_instance.generate_content([prompt, part])
+            response = _generate_content(model_instance, [prompt, part], num_questions, source_type="file")
         else:
             print(f"[INFO] Uploading file to Gemini: {file_path} ({mime_type}), size={file_size_bytes} bytes")
-            uploaded = genai.upload_file(file_path, mime_type=mime_type)
-            active_file = _wait_for_file_active(uploaded)
-            response = model_instance.generate_content([prompt, active_file])
+            with stage_timer("upload_wait"):
+                uploaded = get_provider().upload_file(file_path, mime_type=mime_type)
+                active_file = _wait_for_file_active(uploaded)
+            response = _generate_content(model_instance, [prompt, active_file], num_questions, source_type="file")
 
-        text_output = response.text
-        match = re.search(r"\{[\s\S]*\}", text_output)
-        if match:
-            data = json.loads(match.group(0))
-        else:
-            raise ValueError(f"No valid JSON found in Gemini response. Response: {text_output[:200]}")
-        if 'questions' not in data:
-            raise ValueError("Response does not contain 'questions' key")
-
-        repaired = _validate_and_repair_quiz(data)
+        repaired = _parse_quiz_response(response.text)
         print(f"[OK] Generated {len(repaired['questions'])} questions from file")
         return repaired
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         # Graceful fallback for PDFs: try local text extraction if available
         if mime_type and mime_type.startswith("application/pdf"):
             try:
                 print("[WARN] File upload path failed; falling back to local PDF text extraction...")
                 text = extract_text_from_pdf(file_path)
-                return generate_quiz(text, num_questions=num_questions, model_instance=model_instance)
+                return generate_quiz(text, num_questions=num_questions, model_instance=model_instance,
+                                     avoid_questions=avoid_questions)
             except Exception as inner:
                 raise ValueError(f"Failed to generate quiz from file (and fallback failed): {e}; {inner}")
         raise ValueError(f"Failed to generate quiz from file: {e}")
 
+def _guess_image_mime(file_path: str) -> str:
+    mime_guess, _ = mimetypes.guess_type(file_path)
+    if not mime_guess:
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext in (".png",):
+            mime_guess = "image/png"
+        elif ext in (".jpg", ".jpeg"):
+            mime_guess = "image/jpeg"
+        else:
+            mime_guess = "application/octet-stream"
+    return mime_guess
+
+def generate_quiz_from_images(file_paths: List[str], num_questions: int = 5, model_instance=None,
+                              avoid_questions: Optional[List[str]] = None) -> dict:
+    """Generate one quiz from one or more images of the same lesson in a single request.
+
+    Images are normalized first (downsampled, metadata stripped, re-encoded);
+    see image_pipeline.py. Before/after sizes are added to the result.
+    """
+    if model_instance is None:
+        model_instance = model if model is not None else init_model()
+    if model_instance is None:
+        raise ValueError("Gemini model not configured. Please set your API key first.")
+    if not file_paths:
+        raise ValueError("No images provided")
+    
+    originals = []
+    for path in file_paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {path}")
+        with open(path, "rb") as f:
+            originals.append((f.read(), _guess_image_mime(path)))
+    
+    start = time.perf_counter()
+    images = image_pipeline.normalize_images(originals)
+    summary = image_pipeline.summarize(images, time.perf_counter() - start)
+    print(f"[INFO] Preprocessed {summary['count']} image(s): {summary['bytes_before']} -> {summary['bytes_after']} bytes "
+          f"in {summary['preprocess_ms']} ms")
+    
+    subject = "the attached image" if len(images) == 1 else f"the {len(images)} attached images (all from the same lesson)"
+    prompt = _build_file_prompt(num_questions, subject, avoid_questions)
+    uploaded_paths = []
+    try:
+        if summary["bytes_after"] <= INLINE_UPLOAD_LIMIT_BYTES:
+            print(f"[INFO] Using inline upload (fast path), size={summary['bytes_after']} bytes")
+            parts = [{"mime_type": image.mime_type, "data": image.data} for image in images]
+        else:
+            print(f"[INFO] Uploading {len(images)} image(s) to Gemini, size={summary['bytes_after']} bytes")
+            parts = []
+            with stage_timer("upload_wait"):
+                for image in images:
+                    fd, image_path = tempfile.mkstemp(suffix=mimetypes.guess_extension(image.mime_type) or "")
+                    with os.fdopen(fd, "wb") as out:
+                        out.write(image.data)
+                    uploaded_paths.append(image_path)
+                    uploaded = get_provider().upload_file(image_path, mime_type=image.mime_type)
+                    parts.append(_wait_for_file_active(uploaded))
+        response = _generate_content(model_instance, [prompt] + parts, num_questions, source_type="image")
+        repaired = _parse_quiz_response(response.text)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise ValueError(f"Failed to generate quiz from image: {e}")
+    finally:
+        for image_path in uploaded_paths:
+            try:
+                os.remove(image_path)
+            except OSError:
+                pass
+    
+    print(f"[OK] Generated {len(repaired['questions'])} questions from {len(images)} image(s)")
+    repaired["images"] = summary
+    return repaired
+
 def _extract_youtube_video_id(url: str) -> Optional[str]:
     """Extract video ID from YouTube URL"""
     m = re.match(r"^.*(youtu.be/|v/|u/\w/|embed/|watch\?v=|&v=)([^#&?]*).*$", url)
@@ -317,6 +735,20 @@ def extract_youtube_transcript(url: str) -> str:
     if not vid:
         raise ValueError("Invalid YouTube URL - could not extract video ID")
     
+    cached = _cache_get(("youtube", vid))
+    if cached is not None:
+        print(f"[OK] Using cached transcript for video ID: {vid} ({len(cached)} chars)")
+        return cached
+    
+    with stage_timer("transcript_fetch"):
+        transcript_text = _fetch_youtube_transcript(url, vid)
+    _cache_put(("youtube", vid), transcript_text)
+    return transcript_text
+
+def _fetch_youtube_transcript(url: str, vid: str) -> str:
+    """Fetch and parse subtitles for a video with yt-dlp."""
+    yt_dlp = _lazy_import("yt_dlp")
+    
     print(f"[INFO] Extracting transcript from YouTube video ID: {vid}")
     print(f"[INFO] Full URL: {url}")
     
@@ -436,13 +868,14 @@ def extract_youtube_transcript(url: str) -> str:
         raise ValueError(f"Failed to extract YouTube transcript: {str(e)}")
 
 # --- MAIN FUNCTION ---
-def analyze_and_generate(source_type, source_path_or_url, num_questions=5):
+def analyze_and_generate(source_type, source_path_or_url, num_questions=5, avoid_questions=None):
     """Main function that routes based on content type.
     
     Args:
         source_type: "youtube", "pdf", or "image"
         source_path_or_url: URL for YouTube, file path for PDF/image
         num_questions: Number of questions to generate (default: 5)
+        avoid_questions: Existing questions not to repeat (question bank top-ups)
     
     Returns:
         Dictionary containing quiz questions
@@ -453,32 +886,289 @@ def analyze_and_generate(source_type, source_path_or_url, num_questions=5):
         try:
             transcript = extract_youtube_transcript(source_path_or_url)
             print(f"[INFO] Generating quiz from transcript")
-            return generate_quiz(transcript, num_questions=num_questions)
+            return generate_quiz(transcript, num_questions=num_questions, avoid_questions=avoid_questions)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise ValueError(f"Failed to generate quiz from YouTube: {e}")
     elif source_type == "pdf":
-        # Prefer Gemini multimodal to handle both digital-text and scanned PDFs
-        return generate_quiz_from_file(source_path_or_url, num_questions=num_questions, mime_type="application/pdf")
+        # Digital PDFs go through local text extraction; scanned pages use Gemini multimodal
+        return generate_quiz_from_pdf(source_path_or_url, num_questions=num_questions, avoid_questions=avoid_questions)
     elif source_type == "image":
-        # Use Gemini multimodal for images (PNG/JPG, etc.)
-        mime_guess, _ = mimetypes.guess_type(source_path_or_url)
-        if not mime_guess:
-            ext = os.path.splitext(source_path_or_url)[1].lower()
-            if ext in (".png",):
-                mime_guess = "image/png"
-            elif ext in (".jpg", ".jpeg"):
-                mime_guess = "image/jpeg"
-            else:
-                mime_guess = "application/octet-stream"
-        return generate_quiz_from_file(source_path_or_url, num_questions=num_questions, mime_type=mime_guess)
+        # Use Gemini multimodal for images (PNG/JPG, etc.), normalized first to shrink the payload
+        return generate_quiz_from_images([source_path_or_url], num_questions=num_questions,
+                                         avoid_questions=avoid_questions)
     else:
         raise ValueError(f"Unsupported source type: {source_type}. Use 'youtube', 'pdf', or 'image'")
 
+# --- REQUEST HELPERS (shared by /ai and /ai/batch) ---
+FILE_URL_EXTENSIONS = ['.pdf', '.doc', '.docx', '.ppt', '.pptx', '.xls', '.xlsx',
+                       '.zip', '.rar', '.jpg', '.jpeg', '.png', '.gif', '.mp4',
+                       '.mp3', '.avi', '.mov', '.exe', '.dmg']
+
+def _validate_num_questions(value) -> int:
+    """Coerce numQuestions to int, raising ValueError with a user-facing message."""
+    try:
+        num_questions = int(value)
+    except (ValueError, TypeError):
+        raise ValueError("numQuestions must be a valid integer")
+    if num_questions < 1 or num_questions > 20:
+        raise ValueError("numQuestions must be between 1 and 20")
+    return num_questions
+
+def _json_object(body) -> dict:
+    """Return a parsed JSON request body, raising ValueError unless it is an object."""
+    if not isinstance(body, dict):
+        raise ValueError("JSON body must be an object")
+    return body
+
+def _is_youtube_url(url: str) -> bool:
+    return "youtube.com" in url or "youtu.be" in url
+
+def _url_rejection(url: str) -> Optional[dict]:
+    """Return an error payload for unsupported URLs, or None for YouTube URLs."""
+    if _is_youtube_url(url):
+        return None
+    
+    # Validate that the URL is not a direct file link (PDF, image, etc.)
+    url_lower = url.lower()
+    if any(url_lower.endswith(ext) or f'{ext}?' in url_lower for ext in FILE_URL_EXTENSIONS):
+        return {
+            "error": "File URLs are not supported. Please use YouTube URLs for videos or upload files directly.",
+            "type": "user_error",
+            "suggestion": "For PDF files, use the file upload option instead of providing a URL."
+        }
+    
+    # If it looks like a regular webpage, reject it for now
+    # (We don't have web scraping implemented for security/legal reasons)
+    return {
+        "error": "Only YouTube URLs are currently supported. For other content, please upload as a file or paste text.",
+        "type": "user_error",
+        "suggestion": "Download the webpage content and upload it as a PDF, or copy the text and paste it directly."
+    }
+
+def _source_type_for_upload(filename: Optional[str], content_type: Optional[str]) -> str:
+    """Determine source type from mime type or extension."""
+    suffix = os.path.splitext(filename or "")[1].lower()
+    if content_type and content_type.startswith("application/pdf"):
+        return "pdf"
+    if content_type and content_type.startswith("image/"):
+        return "image"
+    if suffix == ".pdf":
+        return "pdf"
+    if suffix in [".png", ".jpg", ".jpeg"]:
+        return "image"
+    return "pdf"  # default
+
+# Concurrent identical requests (same content + num_questions) share one generation,
+# e.g. a double-clicked "generate" or several supervisors quizzing the same PDF
+quiz_flight = SingleFlight("quiz")
+
+def quiz_fingerprint(kind: str, payload: Union[str, bytes], num_questions: int) -> tuple:
+    """Single-flight key for a quiz request: source kind + content hash + question count."""
+    data = payload.encode("utf-8") if isinstance(payload, str) else payload
+    return (kind, hashlib.sha256(data).hexdigest(), num_questions)
+
+def quiz_from_text(text: str, num_questions: int = 5):
+    """generate_quiz, coalescing concurrent identical requests."""
+    key = quiz_fingerprint("text", text, num_questions)
+    return quiz_flight.do(key, lambda: generate_quiz(text, num_questions=num_questions))
+
+def quiz_from_youtube(url: str, num_questions: int = 5):
+    """Quiz from a YouTube transcript, coalescing concurrent requests for the same video."""
+    key = quiz_fingerprint("youtube", _extract_youtube_video_id(url) or url, num_questions)
+    return quiz_flight.do(key, lambda: analyze_and_generate("youtube", url, num_questions=num_questions))
+
+def generate_quiz_from_upload(filename: Optional[str], content_type: Optional[str], content: bytes, num_questions: int = 5):
+    """Write uploaded bytes to a temp file, generate a quiz from it and clean up.
+
+    Concurrent uploads of the same bytes with the same num_questions are coalesced.
+    """
+    if not content:
+        raise ValueError("Uploaded file is empty")
+    
+    key = quiz_fingerprint(f"file:{_source_type_for_upload(filename, content_type)}", content, num_questions)
+    return quiz_flight.do(key, lambda: _generate_quiz_from_upload(filename, content_type, content, num_questions))
+
+def generate_quiz_from_image_uploads(uploads: List[tuple], num_questions: int = 5):
+    """One quiz from several uploaded images of a lesson, sent in a single request.
+
+    uploads is a list of (filename, content_type, content) tuples.
+    """
+    if any(not content for _, _, content in uploads):
+        raise ValueError("Uploaded file is empty")
+    if any(_source_type_for_upload(name, ctype) != "image" for name, ctype, _ in uploads):
+        raise ValueError("Multiple files can only be combined when they are all images (PNG/JPG)")
+    
+    digest = hashlib.sha256()
+    for _, _, content in uploads:
+        digest.update(hashlib.sha256(content).digest())
+    key = ("images", digest.hexdigest(), num_questions)
+    return quiz_flight.do(key, lambda: _generate_quiz_from_image_uploads(uploads, num_questions))
+
+def _generate_quiz_from_image_uploads(uploads: List[tuple], num_questions: int):
+    temp_paths = []
+    try:
+        for filename, _, content in uploads:
+            fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(filename or "")[1])
+            with os.fdopen(fd, "wb") as out:
+                out.write(content)
+            temp_paths.append(temp_path)
+        print(f"[INFO] Saved {len(temp_paths)} uploaded images for one quiz")
+        return generate_quiz_from_images(temp_paths, num_questions=num_questions)
+    finally:
+        for temp_path in temp_paths:
+            try:
+                os.remove(temp_path)
+            except OSError as cleanup_error:
+                print(f"[WARN] Error cleaning up temp file: {cleanup_error}")
+
+def _generate_quiz_from_upload(filename: Optional[str], content_type: Optional[str], content: bytes, num_questions: int,
+                               avoid_questions: Optional[List[str]] = None):
+    suffix = os.path.splitext(filename or "")[1]
+    fd, temp_path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    
+    try:
+        with open(temp_path, "wb") as out:
+            out.write(content)
+        print(f"[INFO] Saved uploaded file: {filename} ({len(content)} bytes) to {temp_path}")
+        
+        source_type = _source_type_for_upload(filename, content_type)
+        print(f"[INFO] Processing file as: {source_type}, mime_type: {content_type}, extension: {suffix}")
+        
+        return analyze_and_generate(source_type, temp_path, num_questions=num_questions,
+                                    avoid_questions=avoid_questions)
+    except Exception as processing_error:
+        # Log the full error for debugging
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"[ERROR] File processing failed: {processing_error}")
+        print(f"[ERROR] Traceback: {error_trace}")
+        raise
+    finally:
+        # Robust file cleanup
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+                print(f"[INFO] Cleaned up temp file: {temp_path}")
+            except PermissionError:
+                print(f"[WARN] Could not delete temp file (locked): {temp_path}")
+            except Exception as cleanup_error:
+                print(f"[WARN] Error cleaning up temp file: {cleanup_error}")
+
+# --- QUESTION BANK (generate once per content, sample many quizzes) ---
+QUESTION_BANK_MAX_SIZE = int(os.getenv("QUESTION_BANK_MAX_SIZE", "200"))
+QUESTIONS_PER_CALL = 20  # generate_quiz's per-request limit
+
+bank_store = QuestionBankStore()
+_topups_running = set()
+_topups_lock = threading.Lock()
+
+def bank_id_for(kind: str, payload: Union[str, bytes]) -> str:
+    """Bank id: hash of the source kind and content (video id for YouTube)."""
+    data = payload.encode("utf-8") if isinstance(payload, str) else payload
+    return hashlib.sha256(kind.encode("utf-8") + b"\0" + data).hexdigest()
+
+def _validate_pool_size(value) -> int:
+    try:
+        size = int(value)
+    except (ValueError, TypeError):
+        raise ValueError("poolSize must be a valid integer")
+    if size < 1 or size > QUESTION_BANK_MAX_SIZE:
+        raise ValueError(f"poolSize must be between 1 and {QUESTION_BANK_MAX_SIZE}")
+    return size
+
+def _fill_question_bank(bank_id: str, count: int) -> int:
+    """Generate up to `count` new questions into a bank in chunks; returns how many were added."""
+    source = bank_store.get(bank_id)["source"]
+    added_total = 0
+    # Duplicates are dropped, so allow a few extra calls before giving up
+    max_calls = -(-count // QUESTIONS_PER_CALL) + 2
+    for _ in range(max_calls):
+        if added_total >= count:
+            break
+        n = min(QUESTIONS_PER_CALL, count - added_total)
+        existing = [q["question"] for q in bank_store.get(bank_id)["questions"]]
+        if source["kind"] in ("text", "youtube"):
+            result = generate_quiz(source["text"], num_questions=n, avoid_questions=existing)
+        else:
+            content = bank_store.source_path(bank_id).read_bytes()
+            result = _generate_quiz_from_upload(source.get("filename"), source.get("content_type"), content, n,
+                                                avoid_questions=existing)
+        added = bank_store.add_questions(bank_id, result["questions"])
+        added_total += added
+        print(f"[INFO] Question bank {bank_id[:12]}: added {added} of {len(result['questions'])} generated questions")
+        if added == 0:
+            break
+    return added_total
+
+def create_question_bank(kind: str, payload: Union[str, bytes], pool_size: int = QUESTION_BANK_SIZE,
+                         filename: Optional[str] = None, content_type: Optional[str] = None) -> dict:
+    """Create (or return the existing) question bank for a text, YouTube URL or uploaded file.
+
+    kind is "text", "youtube" (payload is the URL) or "file" (payload is the bytes).
+    Concurrent requests for the same content share one generation.
+    """
+    if kind == "youtube":
+        vid = _extract_youtube_video_id(payload)
+        if not vid:
+            raise ValueError("Invalid YouTube URL - could not extract video ID")
+        bank_id = bank_id_for("youtube", vid)
+    elif kind == "file":
+        if not payload:
+            raise ValueError("Uploaded file is empty")
+        bank_id = bank_id_for(f"file:{_source_type_for_upload(filename, content_type)}", payload)
+    else:
+        if not payload or not payload.strip():
+            raise ValueError("Text content is empty. Cannot generate quiz.")
+        bank_id = bank_id_for("text", payload)
+    
+    def build():
+        if bank_store.exists(bank_id) and bank_store.get(bank_id)["questions"]:
+            return {**bank_store.stats(bank_id), "created": False, "generated": 0}
+        if kind == "youtube":
+            source = {"kind": "youtube", "url": payload, "text": extract_youtube_transcript(payload)}
+            bank_store.create(bank_id, source)
+        elif kind == "file":
+            source = {"kind": "file", "filename": filename, "content_type": content_type}
+            bank_store.create(bank_id, source, source_bytes=payload)
+        else:
+            bank_store.create(bank_id, {"kind": "text", "text": payload})
+        generated = _fill_question_bank(bank_id, pool_size)
+        if generated == 0:
+            raise ValueError("Failed to generate any questions for the question bank")
+        return {**bank_store.stats(bank_id), "created": True, "generated": generated}
+    
+    return quiz_flight.do(("bank", bank_id), build)
+
+def top_up_question_bank(bank_id: str, count: int) -> int:
+    """Add `count` questions to an existing bank; skipped if a top-up is already running."""
+    with _topups_lock:
+        if bank_id in _topups_running:
+            return 0
+        _topups_running.add(bank_id)
+    try:
+        return _fill_question_bank(bank_id, count)
+    finally:
+        with _topups_lock:
+            _topups_running.discard(bank_id)
+
+def is_topping_up(bank_id: str) -> bool:
+    with _topups_lock:
+        return bank_id in _topups_running
+
 # --- FastAPI Integration ---
 app = None  # Initialize to None
 
 if FastAPI is not None:
-    app = FastAPI(title="Quiz Generator API")
+    @asynccontextmanager
+    async def lifespan(_app):
+        # Create the model client before serving instead of at import time
+        await run_in_threadpool(init_model)
+        yield
+    
+    app = FastAPI(title="Quiz Generator API", lifespan=lifespan)
     
     if CORSMiddleware:
         app.add_middleware(
@@ -489,6 +1179,12 @@ if FastAPI is not None:
             allow_headers=["*"],
         )
     
+    metrics.install(app)
+    deadline.install(app)
+    
+    # Global limit on concurrently processed batch sources (across all batch requests)
+    _batch_semaphore = asyncio.Semaphore(QUIZ_BATCH_CONCURRENCY)
+    
     def get_error_suggestion(error_msg: str) -> str:
         """Provide helpful suggestions based on error type"""
         error_lower = error_msg.lower()
@@ -498,8 +1194,9 @@ if FastAPI is not None:
                 "Try a different YouTube video with captions enabled, "
                 "or upload the content as a PDF/image file instead."
             )
-        elif "rate limit" in error_lower or "too many requests" in error_lower:
-            return "Please wait 30-60 minutes before trying again, or upload content as a PDF file."
+        elif any(marker in error_lower for marker in ("rate limit", "too many requests", "429", "resource exhausted", "resource has been exhausted", "quota")):
+            # Requests were already queued and retried with backoff by the rate limiter
+            return "The AI service is busy right now. Please try again in a few minutes."
         elif "api key" in error_lower:
             return "Check that your Gemini API key is valid and has sufficient quota."
         elif "too short" in error_lower:
@@ -509,12 +1206,49 @@ if FastAPI is not None:
         else:
             return "Please check your input and try again, or upload content as a PDF file."
     
+    def _server_error_payload(error_msg: str) -> dict:
+        # Provide more helpful error messages
+        error_lower = error_msg.lower()
+        if "gemini" in error_lower or "api key" in error_lower:
+            suggestion = "Check that your Gemini API key is valid and has sufficient quota."
+        elif "file" in error_lower or "pdf" in error_lower:
+            suggestion = "The file may be corrupted or in an unsupported format. Try a different PDF file."
+        else:
+            suggestion = get_error_suggestion(error_msg)
+        
+        return {
+            "error": "An unexpected error occurred. Please try again.",
+            "detail": error_msg,
+            "type": "server_error",
+            "suggestion": suggestion
+        }
+    
+    def _deadline_payload(error_msg: str) -> dict:
+        return {
+            "error": "The request's time budget ran out before the quiz was ready.",
+            "detail": error_msg,
+            "type": "deadline_exceeded",
+            "suggestion": "Please try again; larger files may need a longer timeout.",
+        }
+    
     @app.get("/health")
     def health():
-        return {"status": "ok"}
+        return {
+            "status": "ok",
+            "llm_provider": provider_name(),
+            "rate_limiter": scheduler_stats(["generate", "generate_light"]),
+            "model_routing": model_router.stats(),
+            "single_flight": quiz_flight.stats(),
+            "hedging": deadline.stats(),
+        }
     
     @app.post("/ai")
     async def ai_endpoint(request: Request):
+        # Someone is waiting for this quiz: serve it before batch and question bank work
+        with priority_scope(INTERACTIVE):
+            return await _ai_request(request)
+    
+    async def _ai_request(request: Request):
         try:
             # Parse request based on content type
             content_type = request.headers.get("content-type", "")
@@ -525,6 +1259,7 @@ if FastAPI is not None:
             text = None
             url = None
             file = None
+            files = []
             
             if "application/json" in content_type:
                 # Handle JSON requests
@@ -537,10 +1272,11 @@ if FastAPI is not None:
                 # Handle multipart form data
                 form = await request.form()
                 task = form.get("task")
-                numQuestions = int(form.get("numQuestions", 5))
+                numQuestions = form.get("numQuestions", 5)
                 text = form.get("text")
                 url = form.get("url")
-                file = form.get("file")
+                files = [f for f in form.getlist("file") if hasattr(f, "read")]
+                file = files[0] if files else None
             else:
                 return JSONResponse(
                     {"error": "Unsupported content type"},
@@ -553,111 +1289,37 @@ if FastAPI is not None:
             
             # Validate numQuestions
             try:
-                numQuestions = int(numQuestions)
-                if numQuestions < 1 or numQuestions > 20:
-                    return JSONResponse(
-                        {"error": "numQuestions must be between 1 and 20"},
-                        status_code=400
-                    )
-            except (ValueError, TypeError):
-                return JSONResponse(
-                    {"error": "numQuestions must be a valid integer"},
-                    status_code=400
-                )
+                numQuestions = _validate_num_questions(numQuestions)
+            except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
             
-            # Determine source type and path
-            source_type = None
-            source_path = None
+            # Generation is blocking (extraction + Gemini), so it runs in the
+            # threadpool to keep the event loop free for other requests.
+            if file and len(files) > 1:
+                # Several images of one lesson -> a single multimodal request
+                uploads = [(f.filename, f.content_type, await f.read()) for f in files]
+                result = await run_in_threadpool(generate_quiz_from_image_uploads, uploads, numQuestions)
+                return JSONResponse(result)
             
-            if file:
+            elif file:
                 # Handle file upload
-                suffix = os.path.splitext(file.filename or "")[1]
-                fd, temp_path = tempfile.mkstemp(suffix=suffix)
-                os.close(fd)
-                
-                try:
-                    with open(temp_path, "wb") as out:
-                        content = await file.read()
-                        if not content:
-                            raise ValueError("Uploaded file is empty")
-                        out.write(content)
-                        print(f"[INFO] Saved uploaded file: {file.filename} ({len(content)} bytes) to {temp_path}")
-                    
-                    # Determine type from mime type or extension
-                    if file.content_type and file.content_type.startswith("application/pdf"):
-                        source_type = "pdf"
-                    elif file.content_type and file.content_type.startswith("image/"):
-                        source_type = "image"
-                    elif suffix.lower() == ".pdf":
-                        source_type = "pdf"
-                    elif suffix.lower() in [".png", ".jpg", ".jpeg"]:
-                        source_type = "image"
-                    else:
-                        source_type = "pdf"  # default
-                    
-                    print(f"[INFO] Processing file as: {source_type}, mime_type: {file.content_type}, extension: {suffix}")
-                    
-                    result = analyze_and_generate(source_type, temp_path, num_questions=numQuestions)
-                    return JSONResponse(result)
-                except Exception as processing_error:
-                    # Log the full error for debugging
-                    import traceback
-                    error_trace = traceback.format_exc()
-                    print(f"[ERROR] File processing failed: {processing_error}")
-                    print(f"[ERROR] Traceback: {error_trace}")
-                    raise  # Re-raise to be caught by outer exception handler
-                finally:
-                    # Robust file cleanup
-                    if os.path.exists(temp_path):
-                        try:
-                            os.remove(temp_path)
-                            print(f"[INFO] Cleaned up temp file: {temp_path}")
-                        except PermissionError:
-                            print(f"[WARN] Could not delete temp file (locked): {temp_path}")
-                        except Exception as cleanup_error:
-                            print(f"[WARN] Error cleaning up temp file: {cleanup_error}")
+                content = await file.read()
+                result = await run_in_threadpool(
+                    generate_quiz_from_upload, file.filename, file.content_type, content, numQuestions
+                )
+                return JSONResponse(result)
             
             elif url:
-                # Handle URL (YouTube or web page only)
-                # Check if it's a YouTube URL
-                if "youtube.com" in url or "youtu.be" in url:
-                    source_type = "youtube"
-                    source_path = url
-                    result = analyze_and_generate(source_type, source_path, num_questions=numQuestions)
-                    return JSONResponse(result)
-                else:
-                    # Validate that the URL is not a direct file link (PDF, image, etc.)
-                    url_lower = url.lower()
-                    
-                    # Check for common file extensions in URL
-                    file_extensions = ['.pdf', '.doc', '.docx', '.ppt', '.pptx', '.xls', '.xlsx', 
-                                     '.zip', '.rar', '.jpg', '.jpeg', '.png', '.gif', '.mp4', 
-                                     '.mp3', '.avi', '.mov', '.exe', '.dmg']
-                    
-                    if any(url_lower.endswith(ext) or f'{ext}?' in url_lower for ext in file_extensions):
-                        return JSONResponse(
-                            {
-                                "error": "File URLs are not supported. Please use YouTube URLs for videos or upload files directly.",
-                                "type": "user_error",
-                                "suggestion": "For PDF files, use the file upload option instead of providing a URL."
-                            },
-                            status_code=400
-                        )
-                    
-                    # If it looks like a regular webpage, reject it for now
-                    # (We don't have web scraping implemented for security/legal reasons)
-                    return JSONResponse(
-                        {
-                            "error": "Only YouTube URLs are currently supported. For other content, please upload as a file or paste text.",
-                            "type": "user_error",
-                            "suggestion": "Download the webpage content and upload it as a PDF, or copy the text and paste it directly."
-                        },
-                        status_code=400
-                    )
+                # Handle URL (YouTube only)
+                rejection = _url_rejection(url)
+                if rejection:
+                    return JSONResponse(rejection, status_code=400)
+                result = await run_in_threadpool(quiz_from_youtube, url, numQuestions)
+                return JSONResponse(result)
             
             elif text:
                 # Handle raw text
-                result = generate_quiz(text, num_questions=numQuestions)
+                result = await run_in_threadpool(quiz_from_text, text, numQuestions)
                 return JSONResponse(result)
             
             else:
@@ -666,6 +1328,9 @@ if FastAPI is not None:
                     status_code=400
                 )
         
+        except DeadlineExceeded as e:
+            print(f"[WARN] {e}")
+            return JSONResponse(_deadline_payload(str(e)), status_code=504)
         except ValueError as e:
             # User-friendly errors (like YouTube transcript issues, validation errors)
             error_msg = str(e)
@@ -687,25 +1352,265 @@ if FastAPI is not None:
             import traceback
             error_trace = traceback.format_exc()
             print(f"[ERROR] Full traceback: {error_trace}")
+            return JSONResponse(_server_error_payload(error_msg), status_code=500)
+    
+    async def _run_batch_source(index: int, source: dict, num_questions: int) -> dict:
+        """Generate a quiz for one batch source; never raises, errors become result lines."""
+        line = {"index": index, "id": source.get("id", index)}
+        try:
+            async with _batch_semaphore:
+                if source.get("content") is not None:
+                    result = await run_in_threadpool(
+                        generate_quiz_from_upload,
+                        source.get("filename"), source.get("content_type"), source["content"], num_questions
+                    )
+                elif source.get("url"):
+                    result = await run_in_threadpool(quiz_from_youtube, source["url"], num_questions)
+                else:
+                    result = await run_in_threadpool(quiz_from_text, source["text"], num_questions)
+            line.update({"ok": True, "result": result})
+        except DeadlineExceeded as e:
+            print(f"[WARN] Batch source {index}: {e}")
+            line.update({"ok": False, **_deadline_payload(str(e))})
+        except ValueError as e:
+            error_msg = str(e)
+            print(f"[ERROR] Batch source {index} user error: {error_msg}")
+            line.update({
+                "ok": False,
+                "error": error_msg,
+                "type": "user_error",
+                "suggestion": get_error_suggestion(error_msg),
+            })
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[ERROR] Batch source {index} unexpected error: {error_msg}")
+            line.update({"ok": False, **_server_error_payload(error_msg)})
+        return line
+    
+    @app.post("/ai/batch")
+    async def ai_batch_endpoint(request: Request):
+        """Generate quizzes for many sources in one request, streamed back as NDJSON.
+        
+        JSON body: {"numQuestions": 5, "sources": [{"text": ...} | {"url": ...}, ...]}
+        where each source may carry its own "id" and "numQuestions".
+        Multipart form: repeated "file", "text" and "url" fields plus "numQuestions".
+        
+        Each output line is {"index", "id", "ok", "result" | "error"...} in completion
+        order, followed by a final {"done": true, ...} summary line.
+        """
+        content_type = request.headers.get("content-type", "")
+        sources = []
+        
+        try:
+            if "application/json" in content_type:
+                body = _json_object(await request.json())
+                default_num = body.get("numQuestions", 5)
+                items = body.get("sources") or []
+                if not isinstance(items, list):
+                    raise ValueError("'sources' must be a list")
+                for i, item in enumerate(items):
+                    if not isinstance(item, dict):
+                        raise ValueError(f"Source {i} must be an object with 'text' or 'url'")
+                    if any(item.get(key) is not None and not isinstance(item[key], str) for key in ("text", "url")):
+                        raise ValueError(f"Source {i}: 'text' and 'url' must be strings")
+                    sources.append({
+                        "id": item.get("id", i),
+                        "text": item.get("text"),
+                        "url": item.get("url"),
+                        "numQuestions": item.get("numQuestions", default_num),
+                    })
+            elif "multipart/form-data" in content_type:
+                form = await request.form()
+                default_num = form.get("numQuestions", 5)
+                for upload in form.getlist("file"):
+                    if not hasattr(upload, "read"):
+                        raise ValueError("'file' fields must be file uploads")
+                    # Read eagerly: the form is closed once streaming starts
+                    sources.append({
+                        "id": upload.filename,
+                        "filename": upload.filename,
+                        "content_type": upload.content_type,
+                        "content": await upload.read(),
+                        "numQuestions": default_num,
+                    })
+                for url in form.getlist("url"):
+                    sources.append({"url": url, "numQuestions": default_num})
+                for text in form.getlist("text"):
+                    sources.append({"text": text, "numQuestions": default_num})
+                for i, source in enumerate(sources):
+                    source.setdefault("id", i)
+            else:
+                return JSONResponse({"error": "Unsupported content type"}, status_code=400)
+            
+            if not sources:
+                raise ValueError("Provide at least one source in 'sources' (or 'file'/'text'/'url' fields)")
+            if len(sources) > QUIZ_BATCH_MAX_SOURCES:
+                raise ValueError(f"A batch may contain at most {QUIZ_BATCH_MAX_SOURCES} sources")
+            
+            for i, source in enumerate(sources):
+                source["numQuestions"] = _validate_num_questions(source["numQuestions"])
+                if source.get("content") is None and not source.get("url") and not source.get("text"):
+                    raise ValueError(f"Source {i} must provide 'url' or 'text' or 'file'")
+        except ValueError as e:
+            return JSONResponse({"error": str(e), "type": "user_error"}, status_code=400)
+        
+        print(f"[INFO] Batch request with {len(sources)} sources (concurrency={QUIZ_BATCH_CONCURRENCY})")
+        
+        async def stream_results():
+            pending = []
+            for i, source in enumerate(sources):
+                rejection = _url_rejection(source["url"]) if source.get("url") else None
+                if rejection:
+                    # Unsupported URLs fail immediately without taking a slot
+                    yield json.dumps({"index": i, "id": source["id"], "ok": False, **rejection}) + "\n"
+                    continue
+                pending.append(asyncio.ensure_future(_run_batch_source(i, source, source["numQuestions"])))
             
-            # Provide more helpful error messages
-            error_lower = error_msg.lower()
-            if "gemini" in error_lower or "api key" in error_lower:
-                suggestion = "Check that your Gemini API key is valid and has sufficient quota."
-            elif "file" in error_lower or "pdf" in error_lower:
-                suggestion = "The file may be corrupted or in an unsupported format. Try a different PDF file."
+            succeeded = 0
+            try:
+                for next_done in asyncio.as_completed(pending):
+                    line = await next_done
+                    succeeded += 1 if line["ok"] else 0
+                    yield json.dumps(line) + "\n"
+            finally:
+                # Client disconnected mid-stream: stop queued sources from starting
+                for task in pending:
+                    task.cancel()
+            
+            yield json.dumps({
+                "done": True,
+                "total": len(sources),
+                "succeeded": succeeded,
+                "failed": len(sources) - succeeded,
+            }) + "\n"
+        
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    # Background top-up tasks (references kept so they are not garbage collected)
+    _topup_tasks = set()
+    
+    @app.post("/bank")
+    async def create_bank_endpoint(request: Request):
+        """Generate a question bank for a source once; same inputs as /ai plus "poolSize"."""
+        content_type = request.headers.get("content-type", "")
+        try:
+            if "application/json" in content_type:
+                body = _json_object(await request.json())
+                text, url, upload = body.get("text"), body.get("url"), None
+                pool_size = _validate_pool_size(body.get("poolSize", QUESTION_BANK_SIZE))
+            elif "multipart/form-data" in content_type:
+                form = await request.form()
+                text, url, upload = form.get("text"), form.get("url"), form.get("file")
+                pool_size = _validate_pool_size(form.get("poolSize", QUESTION_BANK_SIZE))
             else:
-                suggestion = get_error_suggestion(error_msg)
+                return JSONResponse({"error": "Unsupported content type"}, status_code=400)
             
-            return JSONResponse(
-                {
-                    "error": "An unexpected error occurred. Please try again.",
-                    "detail": error_msg,
-                    "type": "server_error",
-                    "suggestion": suggestion
-                },
-                status_code=500
-            )
+            if upload is not None and hasattr(upload, "read"):
+                content = await upload.read()
+                result = await run_in_threadpool(
+                    create_question_bank, "file", content, pool_size, upload.filename, upload.content_type
+                )
+            elif url:
+                rejection = _url_rejection(url)
+                if rejection:
+                    return JSONResponse(rejection, status_code=400)
+                result = await run_in_threadpool(create_question_bank, "youtube", url, pool_size)
+            elif text:
+                result = await run_in_threadpool(create_question_bank, "text", text, pool_size)
+            else:
+                return JSONResponse({"error": "Provide 'url' or 'text' or 'file'"}, status_code=400)
+            return JSONResponse(result)
+        except DeadlineExceeded as e:
+            print(f"[WARN] {e}")
+            return JSONResponse(_deadline_payload(str(e)), status_code=504)
+        except ValueError as e:
+            error_msg = str(e)
+            print(f"[ERROR] Question bank user error: {error_msg}")
+            return JSONResponse({
+                "error": error_msg,
+                "type": "user_error",
+                "suggestion": get_error_suggestion(error_msg),
+            }, status_code=400)
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[ERROR] Question bank unexpected error: {error_msg}")
+            return JSONResponse(_server_error_payload(error_msg), status_code=500)
+    
+    @app.get("/bank/{bank_id}")
+    def get_bank_endpoint(bank_id: str):
+        try:
+            return {**bank_store.stats(bank_id), "toppingUp": is_topping_up(bank_id)}
+        except BankNotFound:
+            return JSONResponse({"error": "Question bank not found"}, status_code=404)
+    
+    @app.post("/bank/{bank_id}/quiz")
+    async def bank_quiz_endpoint(bank_id: str, request: Request):
+        """Sample a randomized quiz from a bank (no Gemini call).
+        
+        JSON body: {"numQuestions": 5, "traineeId": "..."}. With a traineeId, questions
+        already served to that trainee are not repeated.
+        """
+        try:
+            body = await request.json()
+        except Exception:
+            body = {}
+        if not isinstance(body, dict):
+            return JSONResponse({"error": "JSON body must be an object"}, status_code=400)
+        try:
+            num_questions = int(body.get("numQuestions", 5))
+            if num_questions < 1:
+                raise ValueError
+        except (ValueError, TypeError):
+            return JSONResponse({"error": "numQuestions must be a positive integer"}, status_code=400)
+        trainee_id = body.get("traineeId")
+        
+        try:
+            result = await run_in_threadpool(bank_store.sample, bank_id, num_questions,
+                                             str(trainee_id) if trainee_id else None)
+        except BankNotFound:
+            return JSONResponse({"error": "Question bank not found"}, status_code=404)
+        except PoolExhausted as e:
+            return JSONResponse({
+                "error": str(e),
+                "type": "pool_exhausted",
+                "suggestion": f"POST /bank/{bank_id}/topup to add more questions.",
+            }, status_code=409)
+        result["bank"]["toppingUp"] = is_topping_up(bank_id)
+        return JSONResponse(result)
+    
+    @app.post("/bank/{bank_id}/topup")
+    async def bank_topup_endpoint(bank_id: str, request: Request):
+        """Start generating more questions for a bank in the background (202 Accepted)."""
+        try:
+            body = await request.json()
+        except Exception:
+            body = {}
+        if not isinstance(body, dict):
+            return JSONResponse({"error": "JSON body must be an object"}, status_code=400)
+        if not bank_store.exists(bank_id):
+            return JSONResponse({"error": "Question bank not found"}, status_code=404)
+        try:
+            count = _validate_pool_size(body.get("count", QUESTION_BANK_SIZE))
+        except ValueError as e:
+            return JSONResponse({"error": str(e).replace("poolSize", "count")}, status_code=400)
+        
+        if is_topping_up(bank_id):
+            return JSONResponse({"bankId": bank_id, "status": "already_running"}, status_code=202)
+        
+        async def run_topup():
+            try:
+                # The task inherits the request's context; the top-up outlives the
+                # request, so it must not run under the caller's time budget
+                with deadline.detached():
+                    added = await run_in_threadpool(top_up_question_bank, bank_id, count)
+                print(f"[OK] Question bank {bank_id[:12]} topped up with {added} questions")
+            except Exception as e:
+                print(f"[ERROR] Question bank {bank_id[:12]} top-up failed: {e}")
+        
+        task = asyncio.create_task(run_topup())
+        _topup_tasks.add(task)
+        task.add_done_callback(_topup_tasks.discard)
+        return JSONResponse({"bankId": bank_id, "status": "started", "count": count}, status_code=202)
 
 # --- CLI and Server Runner ---
 if __name__ == "__main__":
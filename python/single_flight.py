@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Request coalescing ("single flight") for duplicate in-flight work.
+
+When several callers ask for the same key at once, only the first runs the
+function; the others block until it finishes and receive the same result
+(or exception). Once the call completes the key is forgotten, so later
+callers start a fresh computation - this is deduplication of concurrent
+work, not a cache.
+
+Waiting callers keep their own request deadline (see deadline.py): they stop
+waiting with DeadlineExceeded when it passes. The leader's DeadlineExceeded
+is not shared, since it reflects the leader's budget rather than the work;
+waiters retry the call under their own deadline instead.
+
+Callers run in worker threads (FastAPI's threadpool), so this is built on
+threading primitives.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, TypeVar
+
+from deadline import DEADLINE_EXCEEDED, DeadlineExceeded, remaining
+from metrics import counter
+
+T = TypeVar("T")
+
+SINGLE_FLIGHT_CALLS = counter(
+    "single_flight_calls_total", "Calls through a single-flight group", ("group", "result")
+)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """Run fn() for key, or wait for the identical call already in flight."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.executed += 1
+                else:
+                    call.waiters += 1
+                    self.coalesced += 1
+            SINGLE_FLIGHT_CALLS.inc(group=self.name, result="executed" if leader else "coalesced")
+            if leader:
+                break
+
+            left = remaining()
+            if not call.event.wait(timeout=None if left is None else max(left, 0)):
+                DEADLINE_EXCEEDED.inc(where=f"single_flight:{self.name}")
+                raise DeadlineExceeded(f"Request deadline exceeded while waiting for {self.name}")
+            if isinstance(call.error, DeadlineExceeded):
+                # The leader ran out of its own budget; ours may still allow the call
+                SINGLE_FLIGHT_CALLS.inc(group=self.name, result="retried")
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+            }
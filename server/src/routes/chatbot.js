@@ -9,6 +9,7 @@ const router = express.Router();
 // Default company ID from the CSV (can be overridden by environment variable)
 const DEFAULT_COMPANY_ID = process.env.DEFAULT_COMPANY_ID || '68d15d172dfb09cea922278a';
 const PY_CHATBOT_URL = process.env.PY_CHATBOT_SERVICE_URL || 'http://localhost:8002';
+const CHAT_TIMEOUT_MS = 60000; // 60 second timeout
 
 /**
  * Helper function to get company_id from trainee
@@ -85,7 +86,9 @@ router.post('/chat', requireTrainee, async (req, res) => {
       console.log(`   📦 Request body:`, JSON.stringify(requestBody, null, 2));
       
       const chatbotResponse = await axios.post(`${PY_CHATBOT_URL}/chat`, requestBody, {
-        timeout: 60000 // 60 second timeout
+        // Budget slightly below our timeout so the service answers (or gives up) before we do
+        headers: { 'X-Request-Budget-Ms': String(CHAT_TIMEOUT_MS - 1000) },
+        timeout: CHAT_TIMEOUT_MS
       });
 
       console.log(`✅ [Chatbot Proxy] Received response from Python service`);
@@ -108,6 +111,16 @@ router.post('/chat', requireTrainee, async (req, res) => {
         });
       }
 
+      if (axiosError.response?.status === 503 && axiosError.response.headers?.['retry-after']) {
+        // Chatbot shed the request under load; pass the retry hint to the client
+        res.set('Retry-After', axiosError.response.headers['retry-after']);
+        return res.status(503).json({
+          ok: false,
+          error: axiosError.response.data?.detail?.error || 'The assistant is busy right now. Please try again shortly.',
+          type: 'overloaded'
+        });
+      }
+
       if (axiosError.response) {
         // Extract error message more carefully
         let errorMsg = 'Chatbot service error';
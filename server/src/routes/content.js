@@ -1989,6 +1989,9 @@ router.delete('/:id', requireAdminOrSupervisor, async (req, res) => {
 router.post('/ai', requireAdminOrSupervisor, upload.single('file'), async (req, res) => {
   try {
     const PY_AI_URL = process.env.PY_AI_SERVICE_URL || 'http://localhost:8001';
+    const AI_TIMEOUT_MS = 300000; // 5 minute timeout for large files
+    // Tell the Python service how long we will wait so it can give up early instead of working past our timeout
+    const budgetHeaders = { 'X-Request-Budget-Ms': String(AI_TIMEOUT_MS - 2000) };
     const task = req.body.task;
     const numQuestions = parseInt(req.body.numQuestions || '5', 10);
     const incomingUrl = (req.body && (req.body.url || req.body.link || req.body.linkUrl)) || '';
@@ -2049,20 +2052,22 @@ router.post('/ai', requireAdminOrSupervisor, upload.single('file'), async (req,
       console.log(`🤖 [AI Proxy] Sending file to Python service: ${filename}, type: ${req.file.mimetype}, size: ${fileBuffer.length} bytes`);
       
       aiResponse = await axios.post(`${PY_AI_URL}/ai`, formData, {
-        headers: formData.getHeaders ? formData.getHeaders() : {},
+        headers: { ...(formData.getHeaders ? formData.getHeaders() : {}), ...budgetHeaders },
         maxBodyLength: Infinity,
         maxContentLength: Infinity,
-        timeout: 300000 // 5 minute timeout for large files
+        timeout: AI_TIMEOUT_MS
       });
     } else if (incomingText) {
       console.log(`🤖 [AI Proxy] Sending text to Python service: ${incomingText.substring(0, 100)}...`);
       aiResponse = await axios.post(`${PY_AI_URL}/ai`, { task, text: String(incomingText), numQuestions }, {
-        timeout: 300000
+        headers: budgetHeaders,
+        timeout: AI_TIMEOUT_MS
       });
     } else if (incomingUrl) {
       console.log(`🤖 [AI Proxy] Sending URL to Python service: ${incomingUrl}`);
       aiResponse = await axios.post(`${PY_AI_URL}/ai`, { task, url: String(incomingUrl), numQuestions }, {
-        timeout: 300000
+        headers: budgetHeaders,
+        timeout: AI_TIMEOUT_MS
       });
     } else {
       return res.status(400).json({ ok: false, error: "Provide 'file' or 'text' or 'url'" });